@@ -0,0 +1,116 @@
+"""
+Admission control for visitors' transformations.
+
+A job is only accepted while the visitors' backlog (PENDING and PROCESSING jobs, batch
+items excluded) is below ADMISSION_MAX_JOBS and the job's estimated time to result stays
+below ADMISSION_MAX_WAIT_SECONDS. Turning people away quickly keeps the wait bounded for
+everyone who gets in, instead of letting a rush push every visitor's result back.
+
+The estimate comes from recent run times. The queue drains one round per median run
+time, with as many jobs per round as there are worker slots: WORKER_CONCURRENCY times
+WORKER_PROCESSES, less the slots batch items hold, or the PROCESSING jobs if more are
+running. A burst that arrives before the workers' next poll is priced against the idle
+slots that will take it, not against the few jobs running right now.
+
+With a KIOSK_TOKEN configured, public web clients only get ADMISSION_PUBLIC_SHARE of
+both limits, so kiosks at the exhibition still get in when the public share is full.
+"""
+import hmac
+import math
+import time
+from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models
+from .config import (
+    ADMISSION_MAX_JOBS, ADMISSION_MAX_WAIT_SECONDS, ADMISSION_PUBLIC_SHARE, ADMISSION_RUN_TIME_TTL_SECONDS,
+    KIOSK_TOKEN, WORKER_CONCURRENCY, WORKER_PROCESSES,
+)
+
+# Jobs get this priority; workers claim higher priorities first.
+PUBLIC_PRIORITY = 0
+KIOSK_PRIORITY = 1
+
+# Until jobs have completed, assume they take this long.
+DEFAULT_RUN_SECONDS = 60.0
+# Recently completed jobs whose run time makes up the median.
+RUN_TIME_SAMPLES = 50
+
+
+def is_kiosk(token: Optional[str]) -> bool:
+    return bool(KIOSK_TOKEN and token and hmac.compare_digest(token, KIOSK_TOKEN))
+
+
+class AdmissionDecision:
+    def __init__(self, admitted: bool, estimated_wait: float, status_code: int = 200, retry_after: int = 0,
+                 reason: str = ""):
+        self.admitted = admitted
+        # Seconds until the job's result, if it were accepted now.
+        self.estimated_wait = estimated_wait
+        # 429 while only the public share is used up, 503 when the whole backlog is.
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Decides on new jobs from the current backlog and the median run time, cached per process."""
+
+    def __init__(self, run_time_ttl: float = ADMISSION_RUN_TIME_TTL_SECONDS):
+        self._run_time_ttl = run_time_ttl
+        self._run_seconds = DEFAULT_RUN_SECONDS
+        self._run_seconds_fetched_at: Optional[float] = None
+
+    async def check(self, db: AsyncSession, kiosk: bool) -> AdmissionDecision:
+        pending, processing, batch_processing = await self._backlog(db)
+        run_seconds = await self._median_run_seconds(db)
+        slots = max(processing, WORKER_CONCURRENCY * WORKER_PROCESSES - batch_processing, 1)
+        estimated_wait = math.ceil((pending + 1) / slots) * run_seconds
+
+        share = 1.0 if kiosk or not KIOSK_TOKEN else ADMISSION_PUBLIC_SHARE
+        excess_jobs = pending + processing + 1 - ADMISSION_MAX_JOBS * share if ADMISSION_MAX_JOBS else 0
+        excess_wait = estimated_wait - ADMISSION_MAX_WAIT_SECONDS * share if ADMISSION_MAX_WAIT_SECONDS else 0
+        if excess_jobs <= 0 and excess_wait <= 0:
+            return AdmissionDecision(True, estimated_wait)
+
+        # Roughly how long until enough of the backlog finished for this job to fit.
+        retry_after = max(math.ceil(max(excess_jobs, 0) / slots * run_seconds), math.ceil(excess_wait), 1)
+        full = (ADMISSION_MAX_JOBS and pending + processing + 1 > ADMISSION_MAX_JOBS) or \
+            (ADMISSION_MAX_WAIT_SECONDS and estimated_wait > ADMISSION_MAX_WAIT_SECONDS)
+        reason = "backlog_full" if full else "public_share_full"
+        return AdmissionDecision(False, estimated_wait, 503 if full else 429, retry_after, reason)
+
+    async def _backlog(self, db: AsyncSession) -> tuple[int, int, int]:
+        """Visitors' PENDING and PROCESSING jobs, and the batch items PROCESSING."""
+        generation = db_models.Generation
+        is_batch = generation.batch_id.isnot(None)
+        counts = {(status, bool(batch)): count for status, batch, count in (await db.execute(
+            select(generation.status, is_batch, func.count())
+            .where(generation.status.in_([db_models.JobStatus.PENDING, db_models.JobStatus.PROCESSING]))
+            .group_by(generation.status, is_batch)
+        )).all()}
+        return (counts.get((db_models.JobStatus.PENDING, False), 0), counts.get((db_models.JobStatus.PROCESSING, False), 0),
+                counts.get((db_models.JobStatus.PROCESSING, True), 0))
+
+    async def _median_run_seconds(self, db: AsyncSession) -> float:
+        """Median seconds from claim to completion of the last RUN_TIME_SAMPLES visitors' jobs."""
+        now = time.monotonic()
+        if self._run_seconds_fetched_at is not None and now - self._run_seconds_fetched_at < self._run_time_ttl:
+            return self._run_seconds
+        generation = db_models.Generation
+        rows = (await db.execute(
+            select(generation.claimed_at, generation.finished_at)
+            .where(generation.status == db_models.JobStatus.COMPLETED, generation.batch_id.is_(None),
+                   generation.finished_at.isnot(None), generation.claimed_at.isnot(None))
+            .order_by(generation.finished_at.desc())
+            .limit(RUN_TIME_SAMPLES)
+        )).all()
+        if rows:
+            durations = sorted((finished - claimed).total_seconds() for claimed, finished in rows)
+            self._run_seconds = max(durations[len(durations) // 2], 1.0)
+        self._run_seconds_fetched_at = now
+        return self._run_seconds
+
+
+admission_controller = AdmissionController()
@@ -37,11 +37,15 @@ AVAILABLE_TAGS = [
     },
 ]
 
+# Precomputed lookups by id, and by the display name that Generation.tags_used stores.
+TAGS_BY_ID = {tag['id']: tag for tag in AVAILABLE_TAGS}
+TAG_IDS_BY_NAME = {tag['name']: tag['id'] for tag in AVAILABLE_TAGS}
+
 
 def create_system_prompt(tags: list[str]) -> str:
     # MODIFIED: The system prompt is now a function that injects the selected tags.
     
-    tag_names = [tag['name'] for tag in AVAILABLE_TAGS if tag['id'] in tags]
+    tag_names = [TAGS_BY_ID[tag_id]['name'] for tag_id in tags if tag_id in TAGS_BY_ID]
     
     # Create a dynamic instruction string based on the provided tags.
     tag_instruction = ""
@@ -0,0 +1,65 @@
+"""
+Token buckets that pace the provider calls of batch items.
+
+Batches share the OpenAI and Replicate rate limits with visitors. A batch item only
+calls a provider after taking a token from that provider's bucket, so an overnight
+batch stays within a configured share of the quota instead of running into 429s and
+leaving nothing for visitors. Buckets are rows in the `rate_budgets` table, so the
+limit holds across all worker processes and containers.
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select, update
+
+from . import db_models, database
+from .config import (
+    BATCH_OPENAI_REQUESTS_PER_MINUTE, BATCH_OPENAI_BURST, BATCH_REPLICATE_PREDICTIONS_PER_MINUTE,
+    BATCH_REPLICATE_BURST,
+)
+
+
+class TokenBucket:
+    def __init__(self, name: str, per_minute: float, burst: int):
+        self.name = name
+        self._per_second = per_minute / 60
+        self._burst = max(burst, 1)
+
+    async def take(self):
+        """Waits until a token is available and takes it. Returns at once if the bucket has no rate."""
+        if self._per_second <= 0:
+            return
+        while (wait := await self._try_take()) is not None:
+            await asyncio.sleep(wait)
+
+    async def _try_take(self) -> Optional[float]:
+        """
+        Takes a token and returns None, or returns the seconds until the next token. The
+        UPDATE only applies if nobody refilled the bucket since we read it; a worker that
+        loses that race retries right away.
+        """
+        now = datetime.now(timezone.utc)
+        budget = db_models.RateBudget
+        async with database.SessionLocal() as db:
+            await db.execute(
+                database.dialect_insert(budget)
+                .values(name=self.name, tokens=self._burst, refilled_at=now)
+                .on_conflict_do_nothing(index_elements=[budget.name])
+            )
+            row = (await db.execute(select(budget.tokens, budget.refilled_at).where(budget.name == self.name))).one()
+            elapsed = max((now - database.as_utc(row.refilled_at)).total_seconds(), 0)
+            tokens = min(self._burst, row.tokens + elapsed * self._per_second)
+            if tokens < 1:
+                await db.commit()
+                return (1 - tokens) / self._per_second
+            taken = await db.execute(
+                update(budget)
+                .where(budget.name == self.name, budget.refilled_at == row.refilled_at)
+                .values(tokens=tokens - 1, refilled_at=now)
+            )
+            await db.commit()
+        return None if taken.rowcount else 0.0
+
+
+openai_batch_budget = TokenBucket("batch:openai", BATCH_OPENAI_REQUESTS_PER_MINUTE, BATCH_OPENAI_BURST)
+replicate_batch_budget = TokenBucket("batch:replicate", BATCH_REPLICATE_PREDICTIONS_PER_MINUTE, BATCH_REPLICATE_BURST)
@@ -0,0 +1,138 @@
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Paths ---
+IMAGES_DIR = Path("/app/images")
+GENERATED_IMAGES_DIR = IMAGES_DIR / "generated"
+# Content-addressed store for binary uploads, named `{sha256}{ext}`.
+UPLOADS_DIR = IMAGES_DIR / "uploads"
+THUMBNAILS_DIR = Path("/app/thumbnails")
+DATABASE_DIR = Path("/app/database")
+# Prometheus samples of all API and worker processes; shared by the backend and worker containers.
+METRICS_DIR = Path(os.getenv("METRICS_DIR", "/app/metrics"))
+
+# --- Database ---
+# Each process keeps one connection for writes and a pool for reads (see database.py).
+DATABASE_READ_POOL_SIZE = int(os.getenv("DATABASE_READ_POOL_SIZE", "8"))
+# Seconds a request waits for a free pooled connection before failing.
+DATABASE_POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT_SECONDS", "30"))
+# How long SQLite waits for another process's write lock instead of raising "database is locked".
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "10"))
+
+# --- Images ---
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+# Largest accepted upload; nginx's client_max_body_size caps requests at 20M as well.
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+# Longest edge, in pixels, of each responsive thumbnail. Every size is written as WebP and JPEG.
+THUMBNAIL_SIZES = (200, 400, 800)
+# Size of the `{stem}.jpeg` thumbnail that /api/gallery has always returned as `thumbnail`.
+LEGACY_THUMBNAIL_SIZE = 400
+# Processes rendering thumbnails in the background, per API worker.
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Longest edge of the WebP derivatives written next to each generated image: one for
+# gallery cards and one for full-screen viewing instead of the multi-megabyte PNG.
+GENERATED_THUMBNAIL_SIZE = 480
+GENERATED_DISPLAY_SIZE = 1600
+
+# --- Voting & Gamification ---
+VOTE_RATE_LIMIT_SECONDS = 60 # 1 minute
+GAMIFICATION_TARGET_SCORE = 1000
+# Set deadline to July 13, 2025, 23:59:59 UTC
+GAMIFICATION_DEADLINE = datetime(2025, 7, 13, 23, 59, 59, tzinfo=timezone.utc)
+# How long each API process serves the cached happiness score before re-reading the
+# counter, which is also how quickly votes cast via other processes show up.
+GAMIFICATION_SCORE_TTL_SECONDS = float(os.getenv("GAMIFICATION_SCORE_TTL_SECONDS", "2.0"))
+
+# --- Source Gallery ---
+# How often /api/gallery checks the image directories for changes made by other processes.
+GALLERY_REVALIDATE_INTERVAL_SECONDS = 5.0
+
+# --- Public Gallery ---
+PUBLIC_GALLERY_PAGE_SIZE = 30
+PUBLIC_GALLERY_MAX_PAGE_SIZE = 100
+
+# --- AI Providers ---
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+REPLICATE_API_KEY = os.getenv("REPLICATE_API_KEY")
+# Size of the keep-alive connection pool shared by the OpenAI, Replicate and download clients.
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "50"))
+PROVIDER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PROVIDER_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Images are downscaled to this longest edge and re-encoded as EXIF-free JPEG before
+# being sent. The vision model doesn't look at more than ~1024px anyway, and
+# FLUX Kontext renders at about one megapixel.
+OPENAI_IMAGE_MAX_DIMENSION = int(os.getenv("OPENAI_IMAGE_MAX_DIMENSION", "1024"))
+REPLICATE_IMAGE_MAX_DIMENSION = int(os.getenv("REPLICATE_IMAGE_MAX_DIMENSION", "1536"))
+PROVIDER_IMAGE_JPEG_QUALITY = 90
+# Encoded provider images kept in memory per process, keyed by image hash and size.
+PROVIDER_IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("PROVIDER_IMAGE_CACHE_MAX_ENTRIES", "64"))
+
+# --- AI Models ---
+PROMPT_MODEL = "gpt-4.1-mini-2025-04-14" # Don't change this model!
+REPLICATE_MODEL = "black-forest-labs/flux-kontext-pro"
+
+# --- Prompt Cache ---
+# Prompts are cached per image content hash and tag set. Each key collects this many
+# variants from GPT before requests start being answered from the cache in rotation.
+PROMPT_CACHE_VARIANTS = int(os.getenv("PROMPT_CACHE_VARIANTS", "3"))
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Least recently used prompts are evicted beyond this many rows.
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "5000"))
+
+# --- Job Queue ---
+# Transformations are stored as PENDING rows in the `generations` table and picked up
+# by the standalone worker process (`python -m app.worker`), never by the API workers.
+# Maximum number of transformations a single worker process runs at the same time.
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+# Number of worker processes deployed (e.g. `docker-compose up --scale worker=N`). Together
+# with WORKER_CONCURRENCY it is the job capacity that admission control plans with.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+# How long an idle worker waits before checking the queue for new jobs again.
+WORKER_POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL_SECONDS", "1.0"))
+# How long a claimed job belongs to its worker without being renewed. Workers renew their
+# jobs every third of this; after it runs out, another worker resumes the job's Replicate
+# prediction, or puts the job back in the queue if no prediction was created yet.
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "60"))
+
+# --- Admission Control ---
+# /api/transform-image turns visitors away while their backlog (PENDING and PROCESSING jobs,
+# batch items excluded) has this many jobs, or a new job's estimated time to result would
+# exceed this many seconds. 0 disables a limit.
+ADMISSION_MAX_JOBS = int(os.getenv("ADMISSION_MAX_JOBS", "40"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300"))
+# Kiosks send this token in X-Kiosk-Token. With a token configured, public web clients
+# only get this share of both limits, and kiosk jobs are claimed before theirs.
+KIOSK_TOKEN = os.getenv("KIOSK_TOKEN")
+ADMISSION_PUBLIC_SHARE = float(os.getenv("ADMISSION_PUBLIC_SHARE", "0.75"))
+# How long each API process reuses the median job run time behind the wait estimate.
+ADMISSION_RUN_TIME_TTL_SECONDS = 15.0
+
+# --- Batches ---
+# Batch items (POST /api/batches) are only claimed when no live job is waiting, and at most
+# this many of them are PROCESSING at once across all workers, leaving the other worker
+# slots to visitors.
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "2"))
+BATCH_MAX_ITEMS = 500
+# Token buckets pacing the provider calls of batch items, shared by all workers: the
+# sustained rate per minute and how many calls may go out back to back. 0 disables a limit.
+BATCH_OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_OPENAI_REQUESTS_PER_MINUTE", "20"))
+BATCH_OPENAI_BURST = int(os.getenv("BATCH_OPENAI_BURST", "3"))
+BATCH_REPLICATE_PREDICTIONS_PER_MINUTE = float(os.getenv("BATCH_REPLICATE_PREDICTIONS_PER_MINUTE", "6"))
+BATCH_REPLICATE_BURST = int(os.getenv("BATCH_REPLICATE_BURST", "2"))
+
+# --- Job Events (SSE) ---
+# How often each API process checks the jobs its SSE clients are waiting on.
+JOB_EVENTS_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_INTERVAL_SECONDS", "0.5"))
+# Idle streams get a comment frame this often so proxies don't close them.
+JOB_EVENTS_HEARTBEAT_SECONDS = 15.0
+
+# --- Ensure static directories exist ---
+IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+GENERATED_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
+DATABASE_DIR.mkdir(parents=True, exist_ok=True)
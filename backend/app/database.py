@@ -1,9 +1,15 @@
 import os
-from sqlalchemy import create_engine
+from datetime import datetime, timezone
+from sqlalchemy import Connection, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from . import metrics
+from .config import DATABASE_READ_POOL_SIZE, DATABASE_POOL_TIMEOUT_SECONDS, SQLITE_BUSY_TIMEOUT_SECONDS
+
 load_dotenv()
 
 # MODIFIED: The DATABASE_URL now points to a file inside the '/app/database' directory,
@@ -11,31 +17,147 @@ load_dotenv()
 # survives container restarts. The default is set here, but can be overridden in .env.
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database/almere_app.db")
 
-# The connect_args is specific to SQLite and needed for FastAPI's multithreading
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def _async_url(url: str) -> str:
+    """Selects the asyncio driver for the configured backend: aiosqlite or asyncpg."""
+    backend, _, rest = url.partition("://")
+    if "+" in backend:
+        return url # An explicit driver, e.g. postgresql+asyncpg://
+    driver = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+    return f"{driver.get(backend, backend)}://{rest}"
+
+ASYNC_DATABASE_URL = _async_url(DATABASE_URL)
+
+# Applied to every SQLite connection. WAL lets readers run while a write is in progress;
+# synchronous=NORMAL is durable in WAL mode except for the last transactions on power loss.
+SQLITE_PRAGMAS = (
+    f"busy_timeout = {int(SQLITE_BUSY_TIMEOUT_SECONDS * 1000)}",
+    "synchronous = NORMAL",
+    "cache_size = -32000", # 32 MB page cache per connection
+    "mmap_size = 268435456", # 256 MB
+    "temp_store = MEMORY",
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _create_engine(pool_size: int, read_only: bool = False) -> AsyncEngine:
+    if not IS_SQLITE:
+        new_engine = create_async_engine(
+            ASYNC_DATABASE_URL, pool_size=pool_size, pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS, pool_pre_ping=True
+        )
+        metrics.instrument_engine(new_engine.sync_engine)
+        return new_engine
+
+    new_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT_SECONDS},
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # Persistent in the database file; switching needs a writer, so only write connections ask.
+            cursor.execute("PRAGMA journal_mode = WAL")
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    metrics.instrument_engine(new_engine.sync_engine)
+    return new_engine
+
+# On SQLite, each process writes through a single pooled connection, so its writes queue
+# here instead of contending for the file's write lock, while reads use their own pool
+# and, with WAL, never wait behind job updates or votes. PostgreSQL has no such
+# restriction, so both session factories share one regular pool there.
+if IS_SQLITE:
+    engine = _create_engine(pool_size=1)
+    read_engine = _create_engine(pool_size=DATABASE_READ_POOL_SIZE, read_only=True)
+else:
+    engine = read_engine = _create_engine(pool_size=DATABASE_READ_POOL_SIZE)
+
+# Sessions are AsyncSessions: `async with SessionLocal() as db`, then `await db.execute(...)`.
+# Objects stay usable after commit, as attribute access can't lazily reload them in async code.
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+# For code paths that only read; on SQLite these connections reject writes.
+ReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def init_db():
+def as_utc(moment: datetime) -> datetime:
+    """Timestamps are stored in UTC, but SQLite hands them back without a timezone."""
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def dialect_insert(table):
+    """An INSERT for `table` that supports on_conflict_do_update/do_nothing on SQLite and PostgreSQL."""
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    return insert(table)
+
+# Arbitrary, fixed id of the PostgreSQL advisory lock held while migrating.
+MIGRATION_LOCK_KEY = 2075
+
+async def init_db():
     # import all modules here that might define models so that
     # they will be registered properly on the metadata. Otherwise
     # you will have to import them first before calling init_db()
     from . import db_models
-    
-    # MODIFIED: This logic now correctly handles the database path.
-    # It gets the path part of the sqlite URL, e.g., 'database/almere_app.db'
-    db_path = DATABASE_URL.split("///")[-1]
-    db_dir = os.path.dirname(db_path)
-    
-    # Ensure the directory for the database exists within the container.
-    # In Docker, the volume mount should handle this, but this is a robust fallback.
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir)
-        print(f"Created database directory: {db_dir}")
-
-    Base.metadata.create_all(bind=engine)
-    print("Database initialized.")
\ No newline at end of file
+
+    if IS_SQLITE:
+        # MODIFIED: This logic now correctly handles the database path.
+        # It gets the path part of the sqlite URL, e.g., 'database/almere_app.db'
+        db_path = DATABASE_URL.split("///")[-1]
+        db_dir = os.path.dirname(db_path)
+
+        # Ensure the directory for the database exists within the container.
+        # In Docker, the volume mount should handle this, but this is a robust fallback.
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+            print(f"Created database directory: {db_dir}")
+
+    async with engine.begin() as conn:
+        # Processes starting at the same time migrate one after another.
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        else:
+            # The driver doesn't open a transaction for DDL; take the write lock up front instead.
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_existing_tables)
+    print("Database initialized.")
+
+def _upgrade_existing_tables(conn: Connection):
+    """
+    create_all() only creates tables that are missing entirely. Databases created by an
+    older version of the app keep their old schema, so new columns and indexes declared
+    on the models are added here. New columns must be nullable or have a server_default.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT '{default}'" if isinstance(default, str) else f" DEFAULT {default.text}"
+            try:
+                conn.execute(text(ddl))
+                print(f"Added column {table.name}.{column.name}")
+            except OperationalError as e:
+                # On SQLite, another process (API worker or job worker) may have added it first.
+                if "duplicate column" not in str(e).lower():
+                    raise
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+async def close_db():
+    """Closes the pooled connections; called on shutdown."""
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
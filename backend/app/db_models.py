@@ -1,6 +1,7 @@
 import uuid
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, JSON, Enum as SQLAlchemyEnum
+from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, JSON, Index, Enum as SQLAlchemyEnum
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql import func
 import enum
 
@@ -12,6 +13,19 @@ class JobStatus(str, enum.Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+# SQLite stores server_default=func.now() as 'YYYY-MM-DD HH:MM:SS'. Binding datetimes in the
+# same format keeps equality comparisons exact, which the gallery's keyset cursor relies on.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+# The stage timeline measures sub-second stages, so on SQLite it keeps the microseconds.
+# These columns are set from Python rather than by func.now().
+PreciseTimestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d.%(microsecond)06d"),
+    "sqlite",
+)
+
 class Generation(Base):
     __tablename__ = "generations"
 
@@ -21,10 +35,113 @@ class Generation(Base):
     status = Column(SQLAlchemyEnum(JobStatus), default=JobStatus.PENDING, nullable=False)
     original_image_filename = Column(String, nullable=False)
     generated_image_url = Column(String, nullable=True)
+    # WebP derivatives of the generated image, relative to IMAGES_DIR like generated_image_url.
+    thumbnail_url = Column(String, nullable=True)
+    display_url = Column(String, nullable=True)
     prompt_text = Column(String, nullable=True)
     tags_used = Column(JSON, nullable=True)
     creator_name = Column(String, nullable=True)
     votes = Column(Integer, default=0, nullable=False)
     is_visible = Column(Boolean, default=True, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    created_at = Column(Timestamp, server_default=func.now(), nullable=False)
+
+    # --- Job queue bookkeeping ---
+    # Path of the source image relative to IMAGES_DIR, read by the worker process.
+    source_image_path = Column(String, nullable=True)
+    # Set when a worker atomically moves the job from PENDING to PROCESSING.
+    claimed_at = Column(PreciseTimestamp, nullable=True)
+    # The worker running the job, and until when it holds it. Workers extend the lease of
+    # their jobs while they run; a PROCESSING job whose lease ran out lost its worker.
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(PreciseTimestamp, nullable=True)
+
+    # --- Stage timeline (queued is created_at, processing started is claimed_at) ---
+    replicate_prediction_id = Column(String, nullable=True)
+    prediction_created_at = Column(PreciseTimestamp, nullable=True)
+    prediction_finished_at = Column(PreciseTimestamp, nullable=True)
+    downloaded_at = Column(PreciseTimestamp, nullable=True)
+    # When the job became COMPLETED or FAILED.
+    finished_at = Column(PreciseTimestamp, nullable=True)
+    # Class name of the exception that failed the job.
+    error_type = Column(String, nullable=True)
+
+    # The batch the job belongs to, None for visitors' jobs. Batch items may be queued
+    # without a prompt; the worker generates one before starting the prediction.
+    batch_id = Column(String, nullable=True, index=True)
+    # Workers claim visitors' jobs with a higher priority first; kiosk jobs outrank public ones.
+    priority = Column(Integer, default=0, server_default="0", nullable=False)
+    # Random id the visitor's browser sends in X-Client-Id, so /api/public-gallery?mine=true
+    # finds their generations without accounts.
+    client_id = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Supports the worker's "oldest pending job first" claim query.
+        Index("ix_generations_status_created_at", "status", "created_at"),
+        # Serves the public gallery's filter and keyset ordering (votes, created_at, id) straight
+        # from the index, so every page costs the same regardless of its depth.
+        Index("ix_generations_public_gallery", "is_visible", "status", "votes", "created_at", "id"),
+        # Selects the jobs finished within the window of /api/job-stats.
+        Index("ix_generations_finished_at", "finished_at"),
+        # The public gallery filtered by creator name or by client, in the same order as above.
+        Index("ix_generations_creator_gallery", "creator_name", "is_visible", "status", "votes", "created_at", "id"),
+        Index("ix_generations_client_gallery", "client_id", "is_visible", "status", "votes", "created_at", "id"),
+    )
+
+class GenerationTag(Base):
+    """One tag of a generation, by id: the indexed form of Generation.tags_used, which holds display names."""
+    __tablename__ = "generation_tags"
+
+    generation_id = Column(String, primary_key=True)
+    tag_id = Column(String, primary_key=True)
+
+    __table_args__ = (
+        # Finds the generations with a tag for the public gallery's tag filter.
+        Index("ix_generation_tags_tag_id", "tag_id", "generation_id"),
+    )
+
+class Batch(Base):
+    """A group of generations submitted together through POST /api/batches."""
+    __tablename__ = "batches"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    label = Column(String, nullable=True)
+    item_count = Column(Integer, nullable=False)
+    created_at = Column(Timestamp, server_default=func.now(), nullable=False)
+
+class PromptCacheEntry(Base):
+    """One generated prompt for an (image content, tag set) pair; a key holds several variants."""
+    __tablename__ = "prompt_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of the image bytes, followed by the sorted tag ids, e.g. "<hash>:farm_towers,flood_defense".
+    cache_key = Column(String, nullable=False, index=True)
+    prompt_text = Column(String, nullable=False)
+    created_at = Column(Timestamp, server_default=func.now(), nullable=False)
+    last_used_at = Column(Timestamp, server_default=func.now(), nullable=False, index=True)
+
+class VoteRateLimit(Base):
+    """When a client last voted. Shared by all API workers, unlike a per-process dict."""
+    __tablename__ = "vote_rate_limits"
+
+    # The client's IP address.
+    client_key = Column(String, primary_key=True)
+    # Indexed so expired rows can be purged without a table scan.
+    last_vote_at = Column(Timestamp, nullable=False, index=True)
+
+class Counter(Base):
+    """A named running total, kept up to date in the same transactions that change what it counts."""
+    __tablename__ = "counters"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+    # Set by every UPDATE; serves as Last-Modified for the versions in http_cache.py.
+    updated_at = Column(Timestamp, nullable=True, onupdate=func.now())
+
+class RateBudget(Base):
+    """The state of one token bucket in budgets.py, shared by all worker processes."""
+    __tablename__ = "rate_budgets"
 
+    name = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # When `tokens` was last brought up to date; also serves as the row's version.
+    refilled_at = Column(PreciseTimestamp, nullable=False)
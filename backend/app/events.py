@@ -0,0 +1,110 @@
+"""
+Server-Sent Events for job progress.
+
+Job status is written by the worker process, so each API process runs one
+`JobEventBroker` that watches every job its SSE clients are subscribed to with a
+single batched query against the shared database, and fans status changes out to
+the subscribers. The DB cost therefore scales with the number of API processes,
+not with the number of kiosks waiting for a result.
+"""
+import asyncio
+from typing import AsyncIterator
+from sqlalchemy import select
+
+from . import db_models, database, models
+from .config import JOB_EVENTS_POLL_INTERVAL_SECONDS, JOB_EVENTS_HEARTBEAT_SECONDS
+
+TERMINAL_STATUSES = {db_models.JobStatus.COMPLETED, db_models.JobStatus.FAILED}
+# Headers of every event stream; nginx must not buffer them, so events reach clients immediately.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+async def _load_job_statuses(job_ids: list[str]) -> dict[str, models.JobStatusResponse]:
+    async with database.ReadSessionLocal() as db:
+        jobs = await db.scalars(select(db_models.Generation).where(db_models.Generation.id.in_(job_ids)))
+        return {job.id: models.JobStatusResponse.from_generation(job) for job in jobs}
+
+
+class JobEventBroker:
+    def __init__(self, poll_interval: float = JOB_EVENTS_POLL_INTERVAL_SECONDS):
+        self._poll_interval = poll_interval
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._has_subscribers = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        self._has_subscribers.set()
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[job_id]
+        if not self._subscribers:
+            self._has_subscribers.clear()
+
+    async def _run(self):
+        while True:
+            await self._has_subscribers.wait()
+            try:
+                statuses = await _load_job_statuses(list(self._subscribers))
+            except Exception as e:
+                print(f"Job event broker failed to load job statuses: {e}")
+                statuses = {}
+            # Every subscriber gets every poll and drops what it already sent in stream(), so
+            # one that subscribes after the others saw a status change still gets it.
+            for job_id, response in statuses.items():
+                for queue in self._subscribers.get(job_id, ()):
+                    queue.put_nowait(response)
+            await asyncio.sleep(self._poll_interval)
+
+    async def stream(self, initial: models.JobStatusResponse, job_id: str) -> AsyncIterator[str]:
+        """
+        Yields SSE frames for one job: its current state first, then every status change
+        until the job completes or fails. Comment frames keep idle proxies from timing out.
+        """
+        yield format_sse("status", initial.model_dump_json())
+        if initial.status in TERMINAL_STATUSES:
+            return
+
+        queue = self.subscribe(job_id)
+        last_status = initial.status
+        try:
+            while True:
+                try:
+                    response = await asyncio.wait_for(queue.get(), timeout=JOB_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if response.status == last_status:
+                    continue
+                last_status = response.status
+                yield format_sse("status", response.model_dump_json())
+                if response.status in TERMINAL_STATUSES:
+                    return
+        finally:
+            self.unsubscribe(job_id, queue)
+
+
+job_events = JobEventBroker()
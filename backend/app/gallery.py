@@ -0,0 +1,117 @@
+"""
+In-memory index of the source image gallery served by /api/gallery.
+
+The index is a view of the asset manifest (see thumbnails.py): an image is listed
+once its thumbnails are recorded there and the file is still in IMAGES_DIR. Building
+it reads the manifest and lists the directory without touching each file, so it is
+cheap enough to happen on the first request rather than at startup. Uploads rendered
+by this process are added incrementally; changes made by other processes are picked
+up by comparing the mtimes of the manifest and the image directory, which is checked
+at most once per revalidation interval. The index is kept as pre-serialized JSON.
+"""
+import os
+import json
+import time
+import bisect
+import threading
+from pathlib import Path
+from typing import Optional
+from email.utils import formatdate
+
+from .config import IMAGES_DIR, GALLERY_REVALIDATE_INTERVAL_SECONDS
+from .thumbnails import MANIFEST_PATH, load_manifest
+from .http_cache import make_etag
+
+
+def _gallery_entry(filename: str, asset: dict) -> dict:
+    # `thumbnails` maps size -> format -> filename for the responsive variants.
+    return {
+        "filename": filename,
+        "thumbnail": f"{Path(filename).stem}.jpeg",
+        "thumbnails": asset["variants"],
+        "width": asset.get("width"),
+        "height": asset.get("height"),
+    }
+
+
+class GalleryManifest:
+    def __init__(self, images_dir: Path = IMAGES_DIR, manifest_path: Path = MANIFEST_PATH,
+                 revalidate_interval: float = GALLERY_REVALIDATE_INTERVAL_SECONDS):
+        self._images_dir = images_dir
+        self._manifest_path = manifest_path
+        self._revalidate_interval = revalidate_interval
+        self._lock = threading.Lock()
+        self._filenames: list[str] = []
+        self._entries: dict[str, dict] = {}
+        # The body and its ETag, replaced together so readers never pair one with the other's successor.
+        self._rendered = (b"[]", make_etag(b"[]"))
+        self._mtimes: tuple[int, int] | None = None
+        self._checked_at = 0.0
+
+    @property
+    def rendered(self) -> tuple[bytes, str]:
+        """The JSON-encoded gallery index, ready to be sent as a response, and its ETag."""
+        return self._rendered
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        """HTTP date of the last change to the manifest or the image directory, the same in every process."""
+        if not self._mtimes or not any(self._mtimes):
+            return None
+        return formatdate(max(self._mtimes) / 1e9, usegmt=True)
+
+    def needs_revalidation(self) -> bool:
+        return self._mtimes is None or time.monotonic() - self._checked_at >= self._revalidate_interval
+
+    def revalidate(self):
+        """Rebuilds the index if the manifest or the image directory changed since the last build."""
+        mtimes = self._read_mtimes()
+        self._checked_at = time.monotonic()
+        if mtimes != self._mtimes:
+            self.rebuild()
+
+    def rebuild(self):
+        mtimes = self._read_mtimes()
+        assets = load_manifest(self._manifest_path)
+        try:
+            present = set(os.listdir(self._images_dir))
+        except FileNotFoundError:
+            present = set()
+        entries = {
+            name: _gallery_entry(name, asset)
+            for name, asset in assets.items() if name in present and asset.get("variants")
+        }
+        with self._lock:
+            self._entries = entries
+            self._filenames = sorted(entries)
+            self._mtimes = mtimes
+            self._checked_at = time.monotonic()
+            self._serialize()
+
+    def add(self, image_path: Path, asset: dict):
+        """Adds an image whose thumbnails were just rendered and recorded in the manifest."""
+        with self._lock:
+            # Before the first build the manifest, which already has the image, is read in full anyway.
+            if self._mtimes is None or not asset.get("variants"):
+                return
+            if image_path.name not in self._entries:
+                bisect.insort(self._filenames, image_path.name)
+            self._entries[image_path.name] = _gallery_entry(image_path.name, asset)
+            # The mtimes are left as they were: re-reading them here could take in another
+            # process's change too and hide it. The next revalidation rebuilds once instead.
+            self._serialize()
+
+    def _serialize(self):
+        body = json.dumps([self._entries[name] for name in self._filenames]).encode()
+        self._rendered = (body, make_etag(body))
+
+    def _read_mtimes(self) -> tuple[int, int]:
+        def mtime(path: Path) -> int:
+            try:
+                return path.stat().st_mtime_ns
+            except FileNotFoundError:
+                return 0
+        return mtime(self._manifest_path), mtime(self._images_dir)
+
+
+gallery_manifest = GalleryManifest()
@@ -0,0 +1,90 @@
+"""
+The happiness score: the total number of votes on visible generations.
+
+Instead of summing the votes of the whole `generations` table on every request, the
+score is a row in `counters` that voting and hiding adjust in the same transaction as
+the change itself. Each API process caches it for GAMIFICATION_SCORE_TTL_SECONDS and
+refreshes it with a single primary-key read, shared by all requests and SSE streams.
+"""
+import json
+import time
+import asyncio
+from typing import AsyncIterator, Optional
+from sqlalchemy import func, select, literal, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models, database
+from .config import GAMIFICATION_SCORE_TTL_SECONDS, JOB_EVENTS_HEARTBEAT_SECONDS
+from .events import format_sse
+
+HAPPINESS_SCORE = "happiness_score"
+
+
+async def seed_score_counter():
+    """Creates the counter from the current votes if it doesn't exist yet (first start, or an older database)."""
+    counters = db_models.Counter.__table__
+    current_total = select(literal(HAPPINESS_SCORE), func.coalesce(func.sum(db_models.Generation.votes), 0))\
+        .where(db_models.Generation.is_visible == True)
+    statement = database.dialect_insert(counters)\
+        .from_select([counters.c.name, counters.c.value], current_total)\
+        .on_conflict_do_nothing(index_elements=[counters.c.name])
+    async with database.engine.begin() as conn:
+        await conn.execute(statement)
+
+async def adjust_score(db: AsyncSession, delta: int) -> Optional[int]:
+    """Adds `delta` to the score and returns the new value. Leaves committing to the caller."""
+    return await db.scalar(
+        update(db_models.Counter)
+        .where(db_models.Counter.name == HAPPINESS_SCORE)
+        .values(value=db_models.Counter.value + delta)
+        .returning(db_models.Counter.value)
+    )
+
+async def _read_score() -> int:
+    async with database.ReadSessionLocal() as db:
+        return await db.scalar(select(db_models.Counter.value).where(db_models.Counter.name == HAPPINESS_SCORE)) or 0
+
+
+class HappinessScore:
+    def __init__(self, ttl: float = GAMIFICATION_SCORE_TTL_SECONDS):
+        self._ttl = ttl
+        self._value: Optional[int] = None
+        self._fetched_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    def set(self, value: int):
+        """Stores a value this process just committed, so it is served without a read."""
+        self._value = value
+        self._fetched_at = time.monotonic()
+
+    def _is_stale(self) -> bool:
+        return self._value is None or time.monotonic() - self._fetched_at >= self._ttl
+
+    async def get(self) -> int:
+        if self._is_stale():
+            # Concurrent requests share one refresh instead of each reading the counter.
+            async with self._refresh_lock:
+                if self._is_stale():
+                    self.set(await _read_score())
+        return self._value
+
+    async def stream(self, to_payload) -> AsyncIterator[str]:
+        """
+        Yields an SSE `score` frame with `to_payload(score)` now and whenever the score
+        changes. Comment frames keep idle proxies from timing out.
+        """
+        last_sent = None
+        idle_since = time.monotonic()
+        while True:
+            score = await self.get()
+            if score != last_sent:
+                last_sent = score
+                idle_since = time.monotonic()
+                yield format_sse("score", json.dumps(to_payload(score)))
+            elif time.monotonic() - idle_since >= JOB_EVENTS_HEARTBEAT_SECONDS:
+                idle_since = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(self._ttl)
+
+
+happiness_score = HappinessScore()
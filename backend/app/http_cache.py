@@ -0,0 +1,140 @@
+"""
+HTTP caching for the read-heavy endpoints.
+
+Responses carry a strong ETag (a hash of the body) and, where the data has a
+modification time, Last-Modified, so browsers and nginx revalidate with a conditional
+GET and get an empty 304 when nothing changed.
+
+Data that lives in the database is versioned: every write that changes what an
+endpoint returns bumps the resource's row in `counters` in its own transaction (votes,
+hiding, creator names, completed jobs). Each API process caches rendered responses
+per version, so a request costs one primary-key read until the next write.
+"""
+import hashlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from datetime import datetime
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models, database
+
+PUBLIC_GALLERY = "public_gallery"
+VERSIONED_RESOURCES = (PUBLIC_GALLERY,)
+
+# Browsers may reuse a response only after revalidating it with the server.
+REVALIDATE = "no-cache"
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+def http_date(moment: datetime) -> str:
+    return formatdate(database.as_utc(moment).timestamp(), usegmt=True)
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+def _not_modified_since(if_modified_since: str, last_modified: str) -> bool:
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+def conditional_response(request: Request, body: bytes, etag: str, last_modified: Optional[str] = None,
+                         cache_control: str = REVALIDATE) -> Response:
+    """Returns the JSON body, or an empty 304 if the client's copy is still current."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+
+    # If-None-Match takes precedence; If-Modified-Since only counts without it (RFC 9110).
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    else:
+        not_modified = bool(last_modified and if_modified_since and _not_modified_since(if_modified_since, last_modified))
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# --- Versions ---
+
+def _counter_name(resource: str) -> str:
+    return f"version:{resource}"
+
+async def seed_versions():
+    """Creates the version counters that don't exist yet."""
+    counters = db_models.Counter.__table__
+    statement = database.dialect_insert(counters)\
+        .values([{"name": _counter_name(resource), "value": 0} for resource in VERSIONED_RESOURCES])\
+        .on_conflict_do_nothing(index_elements=[counters.c.name])
+    async with database.engine.begin() as conn:
+        await conn.execute(statement)
+
+async def bump_version(db: AsyncSession, resource: str):
+    """Marks the resource as changed. Call it in the transaction that changes it; leaves committing to the caller."""
+    await db.execute(
+        update(db_models.Counter)
+        .where(db_models.Counter.name == _counter_name(resource))
+        .values(value=db_models.Counter.value + 1)
+    )
+
+async def _read_version(resource: str) -> tuple[int, Optional[datetime]]:
+    async with database.ReadSessionLocal() as db:
+        row = (await db.execute(
+            select(db_models.Counter.value, db_models.Counter.updated_at)
+            .where(db_models.Counter.name == _counter_name(resource))
+        )).first()
+    return (row.value, row.updated_at) if row else (0, None)
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, last_modified: Optional[str]):
+        self.body = body
+        self.etag = make_etag(body)
+        self.last_modified = last_modified
+
+
+class VersionedResponseCache:
+    """Rendered responses of one versioned resource, keyed by request parameters."""
+
+    def __init__(self, resource: str, max_entries: int = 256):
+        self._resource = resource
+        self._max_entries = max_entries
+        self._version: Optional[int] = None
+        self._last_modified: Optional[str] = None
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+
+    async def get(self, key: tuple) -> tuple[Optional[CachedResponse], int, Optional[str]]:
+        """
+        Returns the cached response for `key` at the current version, or None, along with
+        the version and its Last-Modified date, to `put` a freshly rendered response under.
+        """
+        version, updated_at = await _read_version(self._resource)
+        if version != self._version:
+            if self._version is not None and version < self._version:
+                # A slower concurrent request read an older version; don't go back to it.
+                return None, version, http_date(updated_at) if updated_at else None
+            self._version = version
+            self._last_modified = http_date(updated_at) if updated_at else None
+            self._entries.clear()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry, version, self._last_modified
+
+    def put(self, key: tuple, version: int, entry: CachedResponse):
+        if version != self._version:
+            return # Rendered from data that a newer version has already replaced.
+        self._entries[key] = entry
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+public_gallery_cache = VersionedResponseCache(PUBLIC_GALLERY)
@@ -0,0 +1,149 @@
+import io
+import os
+import re
+import base64
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+from collections import OrderedDict
+from PIL import Image, ImageOps
+
+from . import metrics
+from .config import IMAGES_DIR, UPLOADS_DIR, PROVIDER_IMAGE_JPEG_QUALITY, PROVIDER_IMAGE_CACHE_MAX_ENTRIES
+
+# Maps (path, size, mtime_ns) to the sha256 of the file, so unchanged files are hashed once.
+# Filled from worker threads, hence the lock; files are hashed outside of it.
+_file_hashes: dict[tuple[str, int, int], str] = {}
+_file_hashes_lock = threading.Lock()
+_FILE_HASHES_MAX_ENTRIES = 4096
+
+# LRU of downscaled provider Data URLs keyed by (image hash, max dimension). Filled from
+# worker threads, hence the lock.
+_provider_images: OrderedDict[tuple[str, int], str] = OrderedDict()
+_provider_images_lock = threading.Lock()
+
+
+# Pillow format -> file extension for the image types we accept as uploads.
+UPLOAD_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+_IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def _resolve_image_path(image_string: str) -> Path:
+    relative_path = image_string.replace('/api/images/', '', 1)
+    return IMAGES_DIR / Path(relative_path)
+
+def _encode_for_provider(image_source, max_dimension: int) -> str:
+    with Image.open(image_source) as img:
+        # Apply the EXIF rotation before it is stripped, then shrink and re-encode.
+        working = ImageOps.exif_transpose(img)
+        if working.mode != "RGB":
+            working = working.convert("RGB")
+        working.thumbnail((max_dimension, max_dimension))
+        buffer = io.BytesIO()
+        working.save(buffer, "JPEG", quality=PROVIDER_IMAGE_JPEG_QUALITY)
+    encoded_string = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{encoded_string}"
+
+def resolve_image_to_data_url(image_string: str, max_dimension: int, image_hash: Optional[str] = None) -> str:
+    """
+    Accepts a string that is either a Data URL or a relative server path.
+    Returns a Data URL, as required by external AI services, of the image downscaled to
+    `max_dimension` and re-encoded as JPEG without metadata. Results are cached per
+    image hash and size, so repeats skip reading and encoding the image.
+    Raises FileNotFoundError if a relative path does not point to a valid file.
+    """
+    image_hash = image_hash or image_content_hash(image_string)
+    cache_key = (image_hash, max_dimension)
+    with _provider_images_lock:
+        if cache_key in _provider_images:
+            _provider_images.move_to_end(cache_key)
+            return _provider_images[cache_key]
+
+    if image_string.startswith('data:'):
+        _, encoded = image_string.split(",", 1)
+        image_source = io.BytesIO(base64.b64decode(encoded))
+    else:
+        # Otherwise, assume it's a relative path like /api/images/foo.jpg
+        image_source = _resolve_image_path(image_string)
+        if not image_source.is_file():
+            raise FileNotFoundError(f"Image file not found: {image_source}")
+    with metrics.timed(metrics.IMAGE_ENCODE_DURATION, max_dimension=str(max_dimension)):
+        data_url = _encode_for_provider(image_source, max_dimension)
+
+    with _provider_images_lock:
+        _provider_images[cache_key] = data_url
+        while len(_provider_images) > PROVIDER_IMAGE_CACHE_MAX_ENTRIES:
+            _provider_images.popitem(last=False)
+    return data_url
+
+def image_content_hash(image_string: str) -> str:
+    """
+    Returns the sha256 hex digest of the image bytes behind a Data URL or relative server
+    path, so the same picture gets the same hash however it was sent.
+    Raises FileNotFoundError if a relative path does not point to a valid file.
+    """
+    if image_string.startswith('data:'):
+        _, encoded = image_string.split(",", 1)
+        return hashlib.sha256(base64.b64decode(encoded)).hexdigest()
+
+    file_path = _resolve_image_path(image_string)
+    if not file_path.is_file():
+        raise FileNotFoundError(f"Image file not found: {file_path}")
+    stat = file_path.stat()
+    memo_key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        cached = _file_hashes.get(memo_key)
+    if cached is not None:
+        return cached
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    image_hash = digest.hexdigest()
+    with _file_hashes_lock:
+        if len(_file_hashes) >= _FILE_HASHES_MAX_ENTRIES:
+            _file_hashes.clear()
+        _file_hashes[memo_key] = image_hash
+    return image_hash
+
+def detect_upload_extension(file_path: Path) -> str:
+    """Returns the extension for an uploaded image, or raises ValueError if it isn't a supported image."""
+    try:
+        with Image.open(file_path) as img:
+            img.verify()
+            image_format = img.format
+    except Exception as e:
+        raise ValueError(f"Not a valid image: {e}") from e
+    if image_format not in UPLOAD_EXTENSIONS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return UPLOAD_EXTENSIONS[image_format]
+
+def resolve_upload_id(image_id: str) -> Path:
+    """
+    Maps a content-addressed image id (the sha256 of the uploaded bytes) to its file.
+    Raises FileNotFoundError for unknown or malformed ids.
+    """
+    if _IMAGE_ID_PATTERN.match(image_id):
+        for extension in UPLOAD_EXTENSIONS.values():
+            candidate = UPLOADS_DIR / f"{image_id}{extension}"
+            if candidate.is_file():
+                return candidate
+    raise FileNotFoundError(f"Unknown image id: {image_id}")
+
+def publish_upload_to_gallery(upload_path: Path) -> tuple[Path, bool]:
+    """
+    Makes an upload part of the source gallery (top level of IMAGES_DIR), as uploaded
+    photos have always been once transformed. Hard-links when possible to avoid a copy.
+    Returns the gallery path and whether this call added it.
+    """
+    gallery_path = IMAGES_DIR / upload_path.name
+    if gallery_path.exists():
+        return gallery_path, False
+    try:
+        os.link(upload_path, gallery_path)
+    except FileExistsError:
+        return gallery_path, False
+    except OSError:
+        shutil.copyfile(upload_path, gallery_path)
+    return gallery_path, True
@@ -0,0 +1,64 @@
+"""
+Latency percentiles per job stage, computed from the timeline the worker records on
+each generation (see db_models.Generation and worker.run_ai_transformation_task).
+
+A stage is the time between two consecutive timestamps on the row, so queue wait,
+our own preparation, Replicate's run time and the download can be told apart.
+Percentiles only cover jobs that completed; failures are counted by error class.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models
+
+# (stage, column it starts at, column it ends at)
+STAGES = (
+    ("queue_wait", "created_at", "claimed_at"),
+    ("prediction_submit", "claimed_at", "prediction_created_at"),
+    ("prediction_run", "prediction_created_at", "prediction_finished_at"),
+    ("download", "prediction_finished_at", "downloaded_at"),
+    ("finalize", "downloaded_at", "finished_at"),
+    ("total", "created_at", "finished_at"),
+)
+PERCENTILES = (50, 95, 99)
+
+
+def _percentile(sorted_values: list[float], percentile: int) -> float:
+    # Nearest rank: the smallest value at or above `percentile` percent of the samples.
+    rank = max(math.ceil(percentile / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+async def stage_percentiles(db: AsyncSession, window: timedelta) -> dict:
+    """Returns job counts and p50/p95/p99 seconds per stage for jobs finished within `window`."""
+    generation = db_models.Generation
+    columns = {name for _, start, end in STAGES for name in (start, end)}
+    rows = (await db.execute(
+        select(generation.status, generation.error_type, *(getattr(generation, name) for name in sorted(columns)))
+        .where(generation.finished_at >= datetime.now(timezone.utc) - window)
+    )).all()
+
+    durations: dict[str, list[float]] = {stage: [] for stage, _, _ in STAGES}
+    errors: dict[str, int] = {}
+    completed = failed = 0
+    for row in rows:
+        if row.status == db_models.JobStatus.FAILED:
+            failed += 1
+            error_type = row.error_type or "unknown"
+            errors[error_type] = errors.get(error_type, 0) + 1
+            continue
+        completed += 1
+        for stage, start, end in STAGES:
+            started, ended = getattr(row, start), getattr(row, end)
+            if started is not None and ended is not None:
+                durations[stage].append((ended - started).total_seconds())
+
+    stages = []
+    for stage, _, _ in STAGES:
+        values = sorted(durations[stage])
+        stage_stats = {"stage": stage, "count": len(values)}
+        for percentile in PERCENTILES:
+            stage_stats[f"p{percentile}"] = _percentile(values, percentile) if values else None
+        stages.append(stage_stats)
+    return {"completed": completed, "failed": failed, "errors": errors, "stages": stages}
@@ -1,236 +1,259 @@
-import os
 import base64
-import io
-import time
+import hashlib
 import random
 import mimetypes
+import json
 import uuid
-import requests
-from datetime import datetime, timezone
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends
+import asyncio
+import aiofiles
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request, Depends, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.datastructures import UploadFile
 from contextlib import asynccontextmanager
-from pathlib import Path
-from PIL import Image
-import openai
-import replicate
-from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-
-from . import db_models, models, database
-from .ai_prompts import AVAILABLE_TAGS, create_system_prompt
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, select, tuple_, literal, update
+
+from . import db_models, models, database, prompt_cache, votes, gamification, http_cache, metrics, job_stats, admission
+from .ai_prompts import AVAILABLE_TAGS, TAGS_BY_ID, create_system_prompt
+from .config import (
+    IMAGES_DIR, THUMBNAILS_DIR, UPLOADS_DIR, UPLOAD_MAX_BYTES,
+    GAMIFICATION_TARGET_SCORE, GAMIFICATION_DEADLINE, OPENAI_API_KEY, REPLICATE_API_KEY,
+    PUBLIC_GALLERY_PAGE_SIZE, PUBLIC_GALLERY_MAX_PAGE_SIZE, OPENAI_IMAGE_MAX_DIMENSION, BATCH_MAX_ITEMS,
+)
+from .images import (
+    resolve_image_to_data_url, image_content_hash, detect_upload_extension, resolve_upload_id,
+    publish_upload_to_gallery,
+)
+from .providers import providers
+from .admission import admission_controller
+from .events import job_events, format_sse, SSE_HEADERS
+from .gamification import happiness_score
+from .gallery import gallery_manifest
+from .thumbnails import thumbnail_pipeline
 
 # --- Globals & In-Memory Stores ---
-# Used for rate-limiting votes. Maps IP to last vote timestamp.
-vote_timestamps = {}
-
-# Load environment variables
-load_dotenv()
-
-# --- Configuration ---
-THUMBNAIL_SIZE = (400, 400)
-IMAGES_DIR = Path("/app/images")
-GENERATED_IMAGES_DIR = IMAGES_DIR / "generated" # ADDED: Directory for generated images
-THUMBNAILS_DIR = Path("/app/thumbnails")
-DATABASE_DIR = Path("/app/database")
-ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
-VOTE_RATE_LIMIT_SECONDS = 60 # 1 minute
-GAMIFICATION_TARGET_SCORE = 1000
-# Set deadline to July 13, 2025, 23:59:59 UTC
-GAMIFICATION_DEADLINE = datetime(2025, 7, 13, 23, 59, 59, tzinfo=timezone.utc)
-
-# --- Ensure static directories exist ---
-IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-GENERATED_IMAGES_DIR.mkdir(parents=True, exist_ok=True) # ADDED
-THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
-DATABASE_DIR.mkdir(parents=True, exist_ok=True)
-
-# API Clients
-openai.api_key = os.getenv("OPENAI_API_KEY")
-replicate_client = replicate.Client(api_token=os.getenv("REPLICATE_API_KEY"))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Room for the multipart boundaries and part headers around an upload of UPLOAD_MAX_BYTES.
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
 
 # --- Database Dependency ---
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-# --- Helper Functions ---
-
-def resolve_image_to_data_url(image_string: str) -> str:
-    """
-    Accepts a string that is either a Data URL or a relative server path.
-    Returns a guaranteed Data URL, which is required by external AI services.
-    Raises FileNotFoundError if a relative path does not point to a valid file.
-    """
-    if image_string.startswith('data:'):
-        # Input is already a Data URL, return it as is.
-        return image_string
-    
-    # Otherwise, assume it's a relative path like /api/images/foo.jpg
-    relative_path = image_string.replace('/api/images/', '', 1)
-    file_path = IMAGES_DIR / Path(relative_path)
-
-    if not file_path.is_file():
-        raise FileNotFoundError(f"Image file not found: {file_path}")
+async def get_read_db():
+    """Like get_db, for endpoints that only read. These never wait for the write connection."""
+    async with database.ReadSessionLocal() as db:
+        yield db
 
-    # Read the file's binary content and encode it to Base64
-    with open(file_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    
-    # Guess the MIME type (e.g., 'image/jpeg') to build the Data URL header
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if not mime_type:
-        mime_type = "image/jpeg" # Provide a sensible fallback
-    
-    return f"data:{mime_type};base64,{encoded_string}"
+# --- Helper Functions ---
 
-def create_thumbnail(image_path: Path):
+def resolve_request_image(request: models.ImageReference) -> str:
+    """Returns the image a request refers to as a Data URL or /api/images/ path."""
+    if request.imageId is None:
+        return request.imageBase64
     try:
-        thumbnail_path = THUMBNAILS_DIR / f"{image_path.stem}.jpeg"
-        if thumbnail_path.exists(): return
-        with Image.open(image_path) as img:
-            img.thumbnail(THUMBNAIL_SIZE)
-            if img.mode in ("RGBA", "P"): img = img.convert("RGB")
-            img.save(thumbnail_path, "JPEG")
-    except Exception as e:
-        print(f"Error creating thumbnail for {image_path.name}: {e}")
-
-def run_ai_transformation_task(job_id: str, image_string_from_request: str, prompt: str, db: Session):
-    """
-    This is the actual long-running task, now updating the database.
-    MODIFIED: It now downloads the generated image and saves it locally.
-    """
-    generation = db.query(db_models.Generation).filter(db_models.Generation.id == job_id).first()
-    if not generation:
-        print(f"[{job_id}] ERROR: Generation record not found in DB.")
-        return
-
-    generation.status = db_models.JobStatus.PROCESSING
-    db.commit()
-
-    try:
-        image_data_url = resolve_image_to_data_url(image_string_from_request)
-        
-        model_name = "black-forest-labs/flux-kontext-pro"
-        input_data = {"prompt": prompt, "input_image": image_data_url, "output_format": "png"}
-        
-        print(f"[{job_id}] Starting Replicate prediction...")
-        prediction = replicate_client.predictions.create(model=model_name, input=input_data)
-        prediction.wait()
-
-        if prediction.status != "succeeded":
-            raise ValueError(f"Prediction failed. Status: {prediction.status}. Error: {prediction.error}")
-        
-        if not prediction.output or not isinstance(prediction.output, str):
-            raise ValueError(f"Model returned invalid output: {prediction.output}")
-
-        print(f"[{job_id}] Prediction successful. Downloading image...")
-        
-        # --- FIXED: Download image from Replicate and save locally ---
-        replicate_url = prediction.output
-        try:
-            response = requests.get(replicate_url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            file_extension = Path(replicate_url).suffix or '.png'
-            local_filename = f"{uuid.uuid4()}{file_extension}"
-            save_path = GENERATED_IMAGES_DIR / local_filename
-            
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            print(f"[{job_id}] Image saved to {save_path}")
-            generation.generated_image_url = f"generated/{local_filename}" # Store relative path
-            generation.status = db_models.JobStatus.COMPLETED
-            db.commit()
-
-        except requests.exceptions.RequestException as e:
-            raise IOError(f"Failed to download image from Replicate: {e}") from e
-
-    except Exception as e:
-        print(f"[{job_id}] --- DETAILED AI TASK ERROR ---")
-        print(f"[{job_id}] Error Type: {type(e).__name__}")
-        print(f"[{job_id}] Error Details: {e}")
-        print(f"[{job_id}] --------------------------------")
-        generation.status = db_models.JobStatus.FAILED
-        db.commit()
-    finally:
-        db.close()
+        upload_path = resolve_upload_id(request.imageId)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown image id.")
+    return f"/api/images/{upload_path.relative_to(IMAGES_DIR).as_posix()}"
 
 
 # --- FastAPI App & Endpoints ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Application starting up...")
-    database.init_db()
-    if IMAGES_DIR.exists():
-        for image_file in IMAGES_DIR.iterdir():
-            if image_file.is_file() and image_file.suffix.lower() in ALLOWED_EXTENSIONS:
-                create_thumbnail(image_file)
+    await database.init_db()
+    await gamification.seed_score_counter()
+    await http_cache.seed_versions()
+    # The gallery index is built from the asset manifest on the first request. New or changed
+    # images are reconciled in the background and join the gallery as their thumbnails are ready.
+    await thumbnail_pipeline.start()
+    await providers.start()
+    await job_events.start()
     yield
+    await job_events.close()
+    await thumbnail_pipeline.close()
+    await providers.close()
+    await database.close_db()
     print("Application shutting down.")
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(metrics.RequestDurationMiddleware)
 
+# In production nginx serves these directories itself (see nginx/nginx.conf); the mounts
+# cover development and setups without the shared volumes.
 app.mount("/api/images", StaticFiles(directory=IMAGES_DIR), name="images")
 app.mount("/api/thumbnails", StaticFiles(directory=THUMBNAILS_DIR), name="thumbnails")
 
 @app.get("/api/gallery")
-async def get_gallery_index():
-    if not IMAGES_DIR.exists(): return []
-    gallery_data = []
-    image_files = sorted([f for f in IMAGES_DIR.iterdir() if f.is_file() and f.suffix.lower() in ALLOWED_EXTENSIONS])
-    for f in image_files:
-        thumbnail_filename = f"{f.stem}.jpeg"
-        if (THUMBNAILS_DIR / thumbnail_filename).exists():
-            gallery_data.append({"filename": f.name, "thumbnail": thumbnail_filename})
-    return gallery_data
+async def get_gallery_index(request: Request):
+    # Served from the prebuilt manifest; the filesystem is only checked once per revalidation interval.
+    if gallery_manifest.needs_revalidation():
+        await asyncio.to_thread(gallery_manifest.revalidate)
+    body, etag = gallery_manifest.rendered
+    return http_cache.conditional_response(request, body, etag, gallery_manifest.last_modified)
+
+# Tags are defined in code, so they only change with a deploy.
+TAGS_BODY = json.dumps(AVAILABLE_TAGS).encode()
+TAGS_ETAG = http_cache.make_etag(TAGS_BODY)
 
 @app.get("/api/tags", response_model=list[models.Tag])
-def get_tags():
-    return AVAILABLE_TAGS
+def get_tags(request: Request):
+    return http_cache.conditional_response(request, TAGS_BODY, TAGS_ETAG)
+
+@app.post("/api/uploads", response_model=models.UploadResponse)
+async def upload_image(request: Request):
+    """
+    Stores a binary multipart image upload (field `file`) under its sha256, so the same
+    photo is only kept once. The returned image_id can be sent as `imageId` to
+    /api/generate-prompt and /api/transform-image instead of a Data URL.
+
+    Oversized requests are refused by their Content-Length before the form is parsed.
+    Starlette spools the parsed file to a temporary file; it is then copied into
+    UPLOADS_DIR in chunks while hashing.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is None or not content_length.isdigit():
+        raise HTTPException(status_code=411, detail="Content-Length is required.")
+    if int(content_length) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large.")
+    form = await request.form(max_files=1, max_fields=1)
+    file = form.get("file")
+    if not isinstance(file, UploadFile):
+        raise HTTPException(status_code=422, detail="Expected an image in the `file` field.")
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = UPLOADS_DIR / f".{uuid.uuid4()}.part"
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="Image is too large.")
+                digest.update(chunk)
+                await out.write(chunk)
+        try:
+            extension = await asyncio.to_thread(detect_upload_extension, tmp_path)
+        except ValueError as e:
+            print(f"Rejected upload: {e}")
+            raise HTTPException(status_code=415, detail="Not a valid image.")
+
+        image_id = digest.hexdigest()
+        final_path = UPLOADS_DIR / f"{image_id}{extension}"
+        if not final_path.exists():
+            tmp_path.replace(final_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        await form.close()
+
+    return {"image_id": image_id, "url": f"/api/images/uploads/{final_path.name}"}
+
+def select_prompt_tags(request: models.GeneratePromptRequest) -> list[str]:
+    """The requested tags, or 1-3 random ones if none were selected."""
+    if request.tags:
+        return request.tags
+    num_tags = random.randint(1, 3)
+    return [tag['id'] for tag in random.sample(AVAILABLE_TAGS, k=num_tags)]
 
 @app.post("/api/generate-prompt", response_model=models.PromptGenerationResponse)
 async def generate_prompt(request: models.GeneratePromptRequest):
-    if not openai.api_key: raise HTTPException(status_code=500, detail="OpenAI API key not configured.")
+    if not OPENAI_API_KEY: raise HTTPException(status_code=500, detail="OpenAI API key not configured.")
     
-    selected_tags_ids = request.tags
-    if not selected_tags_ids:
-        num_tags = random.randint(1, 3)
-        selected_tags_ids = [tag['id'] for tag in random.sample(AVAILABLE_TAGS, k=num_tags)]
-
+    selected_tags_ids = select_prompt_tags(request)
     system_prompt = create_system_prompt(selected_tags_ids)
+    image_string = resolve_request_image(request)
 
     try:
-        image_data_url = resolve_image_to_data_url(request.imageBase64)
-        
-        response = openai.chat.completions.create(
-            model="gpt-4.1-mini-2025-04-14", # Don't change this model!
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": [{"type": "text", "text": "Generate a prompt for this image."}, {"type": "image_url", "image_url": {"url": image_data_url}}]},
-            ],
-            max_tokens=500,
+        # Curated images are requested with the same tags over and over, so serve repeats from the cache.
+        # Upload ids already are the content hash.
+        image_hash = request.imageId or await asyncio.to_thread(image_content_hash, image_string)
+        cache_key = prompt_cache.make_cache_key(image_hash, selected_tags_ids)
+        cached_prompt = await prompt_cache.next_variant(cache_key)
+        if cached_prompt:
+            return {"prompt": cached_prompt, "tags_used": selected_tags_ids}
+
+        # Reading, downscaling and encoding the file is blocking work, keep it off the event loop.
+        image_data_url = await asyncio.to_thread(
+            resolve_image_to_data_url, image_string, OPENAI_IMAGE_MAX_DIMENSION, image_hash
         )
-        generated_prompt = response.choices[0].message.content.strip()
+        generated_prompt = await providers.generate_prompt(system_prompt, image_data_url)
+        await prompt_cache.store(cache_key, generated_prompt)
         return {"prompt": generated_prompt, "tags_used": selected_tags_ids}
     except Exception as e:
         print(f"!!! UNHANDLED EXCEPTION IN generate_prompt: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate prompt: {e}")
 
-@app.post("/api/transform-image", response_model=models.JobCreationResponse)
-async def transform_image(request: models.TransformImageRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    if not os.getenv("REPLICATE_API_KEY"): raise HTTPException(status_code=500, detail="Replicate API key not configured.")
-    
-    image_str = request.imageBase64
-    final_image_filename_for_db = request.original_filename
+@app.post("/api/generate-prompt/stream")
+async def stream_generate_prompt(request: models.GeneratePromptRequest):
+    """
+    Server-Sent Events variant of /api/generate-prompt: `token` events ({"text": ...}) as
+    the model writes, then one `prompt` event with the PromptGenerationResponse. Failures
+    after the stream started arrive as an `error` event ({"detail": ...}).
+    """
+    if not OPENAI_API_KEY: raise HTTPException(status_code=500, detail="OpenAI API key not configured.")
+
+    selected_tags_ids = select_prompt_tags(request)
+    system_prompt = create_system_prompt(selected_tags_ids)
+    image_string = resolve_request_image(request)
+    try:
+        image_hash = request.imageId or await asyncio.to_thread(image_content_hash, image_string)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    cache_key = prompt_cache.make_cache_key(image_hash, selected_tags_ids)
+
+    async def prompt_events():
+        try:
+            prompt = await prompt_cache.next_variant(cache_key)
+            if prompt:
+                yield format_sse("token", json.dumps({"text": prompt}))
+            else:
+                image_data_url = await asyncio.to_thread(
+                    resolve_image_to_data_url, image_string, OPENAI_IMAGE_MAX_DIMENSION, image_hash
+                )
+                parts = []
+                async for text in providers.stream_prompt(system_prompt, image_data_url):
+                    parts.append(text)
+                    yield format_sse("token", json.dumps({"text": text}))
+                prompt = "".join(parts).strip()
+                await prompt_cache.store(cache_key, prompt)
+            response = models.PromptGenerationResponse(prompt=prompt, tags_used=selected_tags_ids)
+            yield format_sse("prompt", response.model_dump_json())
+        except Exception as e:
+            print(f"!!! UNHANDLED EXCEPTION IN stream_generate_prompt: {e}")
+            yield format_sse("error", json.dumps({"detail": f"Failed to generate prompt: {e}"}))
+
+    return StreamingResponse(
+        prompt_events(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+async def store_source_image(request: models.ImageReference, original_filename: Optional[str]) -> tuple[str, str]:
+    """
+    Makes sure the image a transformation starts from is a file in IMAGES_DIR and returns
+    the filename to record for it and its path relative to IMAGES_DIR.
+    """
+    image_str = resolve_request_image(request)
+    final_image_filename_for_db = original_filename
+    source_image_path = image_str.replace('/api/images/', '', 1)
+
+    if request.imageId:
+        # Transformed uploads join the source gallery, like Data URL uploads below.
+        gallery_path, published = await asyncio.to_thread(publish_upload_to_gallery, IMAGES_DIR / source_image_path)
+        # Repeats of an upload already have their thumbnails; a render lost to a restart is
+        # redone by the reconcile task at startup.
+        if published:
+            thumbnail_pipeline.submit(gallery_path, on_done=gallery_manifest.add)
+        final_image_filename_for_db = gallery_path.name
 
     if image_str.startswith('data:'):
         try:
@@ -245,102 +268,354 @@ async def transform_image(request: models.TransformImageRequest, background_task
             with open(save_path, "wb") as f:
                 f.write(image_data)
             
-            create_thumbnail(save_path)
+            thumbnail_pipeline.submit(save_path, on_done=gallery_manifest.add)
             
             final_image_filename_for_db = new_filename
+            source_image_path = new_filename
         except Exception as e:
             print(f"Error saving uploaded image: {e}")
             raise HTTPException(status_code=500, detail="Could not process and save uploaded image.")
     
-    new_generation = db_models.Generation(
-        original_image_filename=final_image_filename_for_db,
+    if not (IMAGES_DIR / source_image_path).is_file():
+        raise HTTPException(status_code=404, detail="Source image not found.")
+    return final_image_filename_for_db or Path(source_image_path).name, source_image_path
+
+def tagged_generation(tag_ids: list[str], **columns) -> tuple[db_models.Generation, list[db_models.GenerationTag]]:
+    """
+    A new generation with the known ones of `tag_ids`, stored as display names in
+    `tags_used` and as rows for the tag index. The caller adds both to the session.
+    """
+    tag_ids = [tag_id for tag_id in dict.fromkeys(tag_ids) if tag_id in TAGS_BY_ID]
+    generation = db_models.Generation(
+        id=str(uuid.uuid4()), tags_used=[TAGS_BY_ID[tag_id]['name'] for tag_id in tag_ids], **columns
+    )
+    return generation, [db_models.GenerationTag(generation_id=generation.id, tag_id=tag_id) for tag_id in tag_ids]
+
+@app.post("/api/transform-image", response_model=models.JobCreationResponse)
+async def transform_image(
+    request: models.TransformImageRequest,
+    db: AsyncSession = Depends(get_db),
+    x_kiosk_token: Optional[str] = Header(default=None),
+    x_client_id: Optional[str] = Header(default=None, max_length=64),
+):
+    if not REPLICATE_API_KEY: raise HTTPException(status_code=500, detail="Replicate API key not configured.")
+
+    # Decided before the image is stored, so turning a visitor away stays cheap.
+    kiosk = admission.is_kiosk(x_kiosk_token)
+    async with database.ReadSessionLocal() as read_db:
+        decision = await admission_controller.check(read_db, kiosk)
+    if not decision.admitted:
+        metrics.ADMISSION_REJECTIONS.labels(decision.reason, "kiosk" if kiosk else "public").inc()
+        wait = f"{round(decision.estimated_wait / 60)} min" if decision.estimated_wait >= 90 else "a minute"
+        return JSONResponse(
+            status_code=decision.status_code,
+            headers={"Retry-After": str(decision.retry_after)},
+            content={
+                "detail": f"The renderers are busy, the wait would be about {wait}. Please try again shortly.",
+                "estimated_wait_seconds": decision.estimated_wait,
+                "retry_after_seconds": decision.retry_after,
+            },
+        )
+
+    original_filename, source_image_path = await store_source_image(request, request.original_filename)
+
+    # The PENDING row is the queue entry; the worker process (app/worker.py) picks it up.
+    new_generation, tags = tagged_generation(
+        request.tags,
+        original_image_filename=original_filename,
+        source_image_path=source_image_path,
         prompt_text=request.prompt,
-        tags_used=[tag_info['name'] for tag_info in AVAILABLE_TAGS if tag_info['id'] in request.tags],
-        status=db_models.JobStatus.PENDING
+        status=db_models.JobStatus.PENDING,
+        priority=admission.KIOSK_PRIORITY if kiosk else admission.PUBLIC_PRIORITY,
+        client_id=x_client_id,
     )
     db.add(new_generation)
-    db.commit()
-    db.refresh(new_generation)
-    
-    job_id = new_generation.id
-    db_for_task = database.SessionLocal()
-    background_tasks.add_task(run_ai_transformation_task, job_id, request.imageBase64, request.prompt, db_for_task)
+    db.add_all(tags)
+    await db.commit()
     
-    return {"job_id": job_id}
+    return {"job_id": new_generation.id, "estimated_wait_seconds": decision.estimated_wait}
+
+# --- Batches ---
+
+@app.post("/api/batches", response_model=models.BatchCreationResponse)
+async def create_batch(request: models.BatchRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Queues one generation per item under a new batch. Items run after visitors' jobs, paced
+    by the batch provider budgets (see app/budgets.py); follow them at /api/batches/{batch_id}.
+    """
+    if not REPLICATE_API_KEY: raise HTTPException(status_code=500, detail="Replicate API key not configured.")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch holds at most {BATCH_MAX_ITEMS} items.")
+    if not OPENAI_API_KEY and any(item.prompt is None for item in request.items):
+        raise HTTPException(status_code=500, detail="OpenAI API key not configured.")
+    unknown_tags = sorted({tag for item in request.items for tag in item.tags or [] if tag not in TAGS_BY_ID})
+    if unknown_tags:
+        raise HTTPException(status_code=400, detail=f"Unknown tags: {', '.join(unknown_tags)}")
+
+    batch = db_models.Batch(id=str(uuid.uuid4()), label=request.label, item_count=len(request.items))
+    db.add(batch)
+    generations = []
+    for item in request.items:
+        original_filename, source_image_path = await store_source_image(item, item.original_filename)
+        generation, tags = tagged_generation(
+            item.tags or ([] if item.prompt else select_prompt_tags(item)),
+            original_image_filename=original_filename,
+            source_image_path=source_image_path,
+            prompt_text=item.prompt,
+            status=db_models.JobStatus.PENDING,
+            batch_id=batch.id,
+        )
+        generations.append(generation)
+        db.add_all(tags)
+    db.add_all(generations)
+    await db.commit()
+
+    return {"batch_id": batch.id, "job_ids": [generation.id for generation in generations]}
+
+@app.get("/api/batches/{batch_id}", response_model=models.BatchStatusResponse)
+async def get_batch_status(batch_id: str, db: AsyncSession = Depends(get_read_db)):
+    batch = await db.get(db_models.Batch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    generation = db_models.Generation
+    rows = (await db.execute(
+        select(generation.id, generation.status, generation.generated_image_url, generation.thumbnail_url)
+        .where(generation.batch_id == batch_id)
+        .order_by(generation.created_at, generation.id)
+    )).all()
+
+    counts = {status: 0 for status in db_models.JobStatus}
+    for row in rows:
+        counts[row.status] += 1
+    return models.BatchStatusResponse(
+        batch_id=batch.id,
+        label=batch.label,
+        created_at=batch.created_at,
+        total=len(rows),
+        pending=counts[db_models.JobStatus.PENDING],
+        processing=counts[db_models.JobStatus.PROCESSING],
+        completed=counts[db_models.JobStatus.COMPLETED],
+        failed=counts[db_models.JobStatus.FAILED],
+        finished=counts[db_models.JobStatus.PENDING] + counts[db_models.JobStatus.PROCESSING] == 0,
+        items=[
+            models.BatchItemStatus(job_id=row.id, status=row.status, generated_image_url=row.generated_image_url,
+                                   thumbnail_url=row.thumbnail_url)
+            for row in rows
+        ],
+    )
 
 @app.get("/api/job-status/{job_id}", response_model=models.JobStatusResponse)
-async def get_job_status(job_id: str, db: Session = Depends(get_db)):
-    job = db.query(db_models.Generation).filter(db_models.Generation.id == job_id).first()
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_read_db)):
+    job = await db.get(db_models.Generation, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    response = {"status": job.status, "result": None, "error": None, "generation_data": None}
-    if job.status == db_models.JobStatus.COMPLETED:
-        job_data = models.GenerationInfo.from_orm(job)
-        # The 'result' field is kept for legacy compatibility if any old logic uses it,
-        # but new logic should rely on the full generation_data object.
-        response["result"] = job.generated_image_url
-        response["generation_data"] = job_data
-    elif job.status == db_models.JobStatus.FAILED:
-        response["error"] = "AI transformation failed. See server logs for details."
-    return response
+    return models.JobStatusResponse.from_generation(job)
+
+@app.get("/api/job-events/{job_id}")
+async def stream_job_events(job_id: str, db: AsyncSession = Depends(get_read_db)):
+    """
+    Server-Sent Events stream of `status` events, each carrying a JobStatusResponse.
+    Sends the current state immediately and closes after the job completes or fails.
+    """
+    job = await db.get(db_models.Generation, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    initial = models.JobStatusResponse.from_generation(job)
+    await db.close()
+
+    return StreamingResponse(
+        job_events.stream(initial, job_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
 
 # --- New Endpoints for Gallery, Voting, and Gamification ---
 
-@app.get("/api/public-gallery", response_model=list[models.GenerationInfo])
-def get_public_gallery(db: Session = Depends(get_db)):
-    generations = db.query(db_models.Generation)\
-        .filter(db_models.Generation.is_visible == True, db_models.Generation.status == db_models.JobStatus.COMPLETED)\
-        .order_by(db_models.Generation.votes.desc(), db_models.Generation.created_at.desc())\
-        .all()
-    return generations
+def encode_gallery_cursor(generation: db_models.Generation) -> str:
+    """Encodes the sort key of the last item on a page as an opaque, URL-safe cursor."""
+    key = [generation.votes, generation.created_at.isoformat(), generation.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
-@app.post("/api/generations/{job_id}/vote")
-def vote_for_generation(job_id: str, request: Request, db: Session = Depends(get_db)):
-    client_ip = request.client.host
-    current_time = time.time()
+def decode_gallery_cursor(cursor: str) -> tuple[int, datetime, str]:
+    try:
+        votes, created_at, generation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(votes), datetime.fromisoformat(created_at), str(generation_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid gallery cursor.")
+
+@app.get("/api/public-gallery", response_model=models.PublicGalleryPage)
+async def get_public_gallery(
+    request: Request,
+    limit: int = Query(PUBLIC_GALLERY_PAGE_SIZE, ge=1, le=PUBLIC_GALLERY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    tag: Optional[str] = Query(None, description="Only generations with this tag id."),
+    creator: Optional[str] = Query(None, description="Only generations with this creator name."),
+    mine: bool = Query(False, description="Only generations started by the client in X-Client-Id."),
+    x_client_id: Optional[str] = Header(default=None, max_length=64),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Visible, completed generations ordered by votes, newest first among equals. Pages use
+    keyset pagination: the cursor holds the (votes, created_at, id) of the last item seen,
+    so the database seeks straight to the next page through ix_generations_public_gallery
+    (or the creator/client index when filtering by those) instead of skipping over all
+    earlier rows. Rendered pages are cached until the next write to the gallery bumps its
+    version; a client's own generations are not cached.
+    """
+    if tag is not None and tag not in TAGS_BY_ID:
+        raise HTTPException(status_code=400, detail=f"Unknown tag: {tag}")
+    if mine and not x_client_id:
+        raise HTTPException(status_code=400, detail="mine=true needs the X-Client-Id header.")
+    client_id = x_client_id if mine else None
+
+    if client_id:
+        page = await _query_public_gallery(db, limit, cursor, tag, creator, client_id)
+        body = page.model_dump_json().encode()
+        return http_cache.conditional_response(request, body, http_cache.make_etag(body), cache_control="private, no-cache")
+
+    cache_key = (limit, cursor, tag, creator)
+    cached, version, last_modified = await http_cache.public_gallery_cache.get(cache_key)
+    if cached is None:
+        page = await _query_public_gallery(db, limit, cursor, tag, creator)
+        cached = http_cache.CachedResponse(page.model_dump_json().encode(), last_modified)
+        http_cache.public_gallery_cache.put(cache_key, version, cached)
+    return http_cache.conditional_response(request, cached.body, cached.etag, cached.last_modified)
+
+async def _query_public_gallery(db: AsyncSession, limit: int, cursor: Optional[str], tag: Optional[str] = None,
+                                creator: Optional[str] = None, client_id: Optional[str] = None) -> models.PublicGalleryPage:
+    sort_columns = (db_models.Generation.votes, db_models.Generation.created_at, db_models.Generation.id)
+    query = select(db_models.Generation)\
+        .where(db_models.Generation.is_visible == True, db_models.Generation.status == db_models.JobStatus.COMPLETED)
+    if tag:
+        # Starts from the tag's rows in ix_generation_tags_tag_id rather than scanning the gallery.
+        query = query.join(db_models.GenerationTag, and_(
+            db_models.GenerationTag.generation_id == db_models.Generation.id, db_models.GenerationTag.tag_id == tag,
+        ))
+    if creator:
+        query = query.where(db_models.Generation.creator_name == creator)
+    if client_id:
+        query = query.where(db_models.Generation.client_id == client_id)
+    if cursor:
+        # Bind each value with its column's type so SQLite compares timestamps in their stored format.
+        last_seen = [literal(value, column.type) for value, column in zip(decode_gallery_cursor(cursor), sort_columns)]
+        query = query.where(tuple_(*sort_columns) < tuple_(*last_seen))
+
+    # Fetch one extra row to learn whether another page exists.
+    generations = (await db.scalars(
+        query
+        .order_by(db_models.Generation.votes.desc(), db_models.Generation.created_at.desc(), db_models.Generation.id.desc())
+        .limit(limit + 1)
+    )).all()
+
+    next_cursor = None
+    if len(generations) > limit:
+        generations = generations[:limit]
+        next_cursor = encode_gallery_cursor(generations[-1])
+    return models.PublicGalleryPage(
+        items=[models.GenerationInfo.model_validate(generation) for generation in generations],
+        next_cursor=next_cursor,
+    )
 
-    last_vote_time = vote_timestamps.get(client_ip, 0)
-    if (current_time - last_vote_time) < VOTE_RATE_LIMIT_SECONDS:
+@app.post("/api/generations/{job_id}/vote")
+async def vote_for_generation(job_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    # The vote and the rate limit are one transaction: either both are recorded or neither.
+    if not await votes.try_acquire_vote_slot(db, request.client.host):
+        await db.rollback()
         raise HTTPException(status_code=429, detail="You can only vote once per minute.")
 
-    generation = db.query(db_models.Generation).filter(db_models.Generation.id == job_id).first()
-    if not generation:
+    vote = await votes.add_vote(db, job_id)
+    if vote is None:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Generation not found.")
-    
-    generation.votes = (generation.votes or 0) + 1
-    db.commit()
-    
-    vote_timestamps[client_ip] = current_time
-    return {"message": "Vote successful", "new_vote_count": generation.votes}
+    score = None
+    if vote.is_visible:
+        score = await gamification.adjust_score(db, 1)
+        await http_cache.bump_version(db, http_cache.PUBLIC_GALLERY)
+    await db.commit()
+
+    if score is not None:
+        happiness_score.set(score)
+    await votes.purge_expired_rate_limits(db)
+    return {"message": "Vote successful", "new_vote_count": vote.votes}
 
 @app.post("/api/generations/{job_id}/hide")
-def hide_generation(job_id: str, db: Session = Depends(get_db)):
-    generation = db.query(db_models.Generation).filter(db_models.Generation.id == job_id).first()
-    if not generation:
-        raise HTTPException(status_code=404, detail="Generation not found.")
-    
-    generation.is_visible = False
-    db.commit()
+async def hide_generation(job_id: str, db: AsyncSession = Depends(get_db)):
+    # Only the request that actually hides it takes its votes off the happiness score.
+    hidden_votes = await db.scalar(
+        update(db_models.Generation)
+        .where(db_models.Generation.id == job_id, db_models.Generation.is_visible == True)
+        .values(is_visible=False)
+        .returning(db_models.Generation.votes)
+    )
+    if hidden_votes is None:
+        if await db.get(db_models.Generation, job_id) is None:
+            raise HTTPException(status_code=404, detail="Generation not found.")
+    else:
+        score = await gamification.adjust_score(db, -hidden_votes)
+        await http_cache.bump_version(db, http_cache.PUBLIC_GALLERY)
+        await db.commit()
+        if score is not None:
+            happiness_score.set(score)
     return {"message": "Generation hidden from public gallery."}
 
 @app.post("/api/generations/{job_id}/set-name")
-def set_creator_name(job_id: str, request: models.SetCreatorNameRequest, db: Session = Depends(get_db)):
-    generation = db.query(db_models.Generation).filter(db_models.Generation.id == job_id).first()
+async def set_creator_name(job_id: str, request: models.SetCreatorNameRequest, db: AsyncSession = Depends(get_db)):
+    generation = await db.get(db_models.Generation, job_id)
     if not generation:
         raise HTTPException(status_code=404, detail="Generation not found.")
     
     generation.creator_name = request.name
-    db.commit()
+    await http_cache.bump_version(db, http_cache.PUBLIC_GALLERY)
+    await db.commit()
     return {"message": "Creator name updated."}
 
-@app.get("/api/gamification-stats", response_model=models.GamificationStatsResponse)
-def get_gamification_stats(db: Session = Depends(get_db)):
-    total_votes = db.query(func.sum(db_models.Generation.votes)).filter(db_models.Generation.is_visible == True).scalar()
-    
+def gamification_stats(score: int) -> dict:
     return {
-        "happiness_score": total_votes or 0,
+        "happiness_score": score,
         "target_score": GAMIFICATION_TARGET_SCORE,
         "deadline_iso": GAMIFICATION_DEADLINE.isoformat()
     }
 
+@app.get("/api/gamification-stats", response_model=models.GamificationStatsResponse)
+async def get_gamification_stats(request: Request):
+    body = json.dumps(gamification_stats(await happiness_score.get())).encode()
+    return http_cache.conditional_response(request, body, http_cache.make_etag(body))
+
+@app.get("/api/job-stats", response_model=models.JobStatsResponse)
+async def get_job_stats(
+    window_hours: float = Query(24, gt=0, le=24 * 30),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """p50/p95/p99 per job stage (queue wait, Replicate, download...) of the jobs finished in the window."""
+    stats = await job_stats.stage_percentiles(db, timedelta(hours=window_hours))
+    return {"window_hours": window_hours, **stats}
+
+@app.get("/api/metrics", include_in_schema=False)
+async def get_metrics(db: AsyncSession = Depends(get_read_db)):
+    """Prometheus metrics of every API and worker process, plus the job queue."""
+    jobs_by_status = {status.value: 0 for status in db_models.JobStatus}
+    status_counts = await db.execute(
+        select(db_models.Generation.status, func.count()).group_by(db_models.Generation.status)
+    )
+    for status, count in status_counts:
+        jobs_by_status[status.value] = count
+    oldest_pending = await db.scalar(
+        select(func.min(db_models.Generation.created_at))
+        .where(db_models.Generation.status == db_models.JobStatus.PENDING)
+    )
+    oldest_pending_seconds = 0.0
+    if oldest_pending:
+        oldest_pending_seconds = max((datetime.now(timezone.utc) - database.as_utc(oldest_pending)).total_seconds(), 0.0)
+    body = await asyncio.to_thread(metrics.render, jobs_by_status, oldest_pending_seconds)
+    return Response(content=body, media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/api/gamification-stats/stream")
+async def stream_gamification_stats():
+    """Server-Sent Events: the stats as a `score` event now and whenever the score changes."""
+    return StreamingResponse(
+        happiness_score.stream(gamification_stats),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
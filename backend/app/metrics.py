@@ -0,0 +1,170 @@
+"""
+Prometheus metrics for the API and the worker, served at /api/metrics.
+
+uvicorn runs several API processes and jobs run in separate worker processes, so the
+metrics use prometheus_client's multiprocess mode: every process writes its samples to
+memory-mapped files and /api/metrics merges the files of all of them. PIDs are only
+unique within a container, so each container writes to its own subdirectory of
+METRICS_DIR; the directory must be a volume shared by the backend and worker.
+
+Job counts per status and the queue are read from the database at scrape time instead
+of being tracked in every process.
+"""
+import os
+import glob
+import time
+import socket
+from contextlib import contextmanager
+from sqlalchemy import Engine, event
+
+from .config import METRICS_DIR
+
+# prometheus_client chooses where it stores samples when it is first imported.
+PROCESS_METRICS_DIR = METRICS_DIR / socket.gethostname()
+PROCESS_METRICS_DIR.mkdir(parents=True, exist_ok=True)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(PROCESS_METRICS_DIR)
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# Provider calls take seconds to minutes; the defaults stop at 10s.
+PROVIDER_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "almere_http_request_duration_seconds", "Time until the response headers are sent, per route.",
+    ["method", "route", "status"],
+)
+OPENAI_REQUEST_DURATION = Histogram(
+    "almere_openai_request_duration_seconds", "Duration of prompt generation calls to OpenAI.",
+    ["outcome"], buckets=PROVIDER_BUCKETS,
+)
+REPLICATE_STAGE_DURATION = Histogram(
+    "almere_replicate_stage_duration_seconds",
+    "Duration of creating a Replicate prediction, waiting for it and downloading its output.",
+    ["stage", "outcome"], buckets=PROVIDER_BUCKETS,
+)
+IMAGE_ENCODE_DURATION = Histogram(
+    "almere_image_encode_duration_seconds", "Time to downscale and encode an image for a provider (cache misses).",
+    ["max_dimension", "outcome"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "almere_admission_rejections", "Transformations turned away by admission control (see app/admission.py).",
+    ["reason", "client"],
+)
+DB_QUERY_DURATION = Histogram(
+    "almere_db_query_duration_seconds", "Database statement execution time.",
+    ["operation"], buckets=DB_BUCKETS,
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """
+    Observes how long the block takes. The `outcome` label is "ok", or "error" if the
+    block raises; the block may set its own outcome in the yielded labels.
+    """
+    start = time.perf_counter()
+    outcome = {}
+    try:
+        yield outcome
+    except BaseException:
+        outcome["outcome"] = "error"
+        raise
+    finally:
+        histogram.labels(**labels, outcome=outcome.get("outcome", "ok")).observe(time.perf_counter() - start)
+
+
+# --- HTTP ---
+
+class RequestDurationMiddleware:
+    """
+    Records HTTP_REQUEST_DURATION under the route's path template, so /api/job-status/{job_id}
+    is one series. Measures until the response starts, which keeps SSE streams meaningful.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        observed = False
+
+        def observe(status: int):
+            nonlocal observed
+            observed = True
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
+
+        async def send_and_observe(message):
+            if message["type"] == "http.response.start" and not observed:
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_observe)
+        except BaseException:
+            if not observed:
+                observe(500)
+            raise
+
+
+# --- Database ---
+
+def instrument_engine(engine: Engine):
+    """Times every statement the engine executes into DB_QUERY_DURATION."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _observe(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start_times"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_DURATION.labels(operation).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def _discard_timer(context):
+        start_times = context.connection.info.get("query_start_times") if context.connection else None
+        if start_times:
+            start_times.pop()
+
+
+# --- Exposition ---
+
+class _AllProcessesCollector:
+    """Merges the samples written by every process of every container."""
+
+    def collect(self):
+        files = glob.glob(str(METRICS_DIR / "*" / "*.db"))
+        return MultiProcessCollector.merge(files, accumulate=True)
+
+
+class _JobsCollector:
+    def __init__(self, jobs_by_status: dict[str, int], oldest_pending_seconds: float):
+        self._jobs_by_status = jobs_by_status
+        self._oldest_pending_seconds = oldest_pending_seconds
+
+    def collect(self):
+        jobs = GaugeMetricFamily("almere_jobs", "Generations per job status.", labels=["status"])
+        for status, count in self._jobs_by_status.items():
+            jobs.add_metric([status], count)
+        yield jobs
+        yield GaugeMetricFamily(
+            "almere_job_queue_oldest_pending_seconds", "Age of the oldest pending job, 0 if the queue is empty.",
+            value=self._oldest_pending_seconds,
+        )
+
+
+def render(jobs_by_status: dict[str, int], oldest_pending_seconds: float) -> bytes:
+    """The Prometheus text exposition of all processes' metrics plus the current job counts."""
+    registry = CollectorRegistry()
+    registry.register(_AllProcessesCollector())
+    registry.register(_JobsCollector(jobs_by_status, oldest_pending_seconds))
+    return generate_latest(registry)
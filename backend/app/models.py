@@ -1,20 +1,38 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Any
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+from typing import Dict, List, Optional, Any
 from datetime import datetime
 from .db_models import JobStatus
 
 # --- Request Models ---
 
-class GeneratePromptRequest(BaseModel):
-    imageBase64: str
+class ImageReference(BaseModel):
+    # Either a Data URL / relative server path, or the id returned by POST /api/uploads.
+    imageBase64: Optional[str] = None
+    imageId: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_exactly_one_image(self):
+        if (self.imageBase64 is None) == (self.imageId is None):
+            raise ValueError("Provide exactly one of imageBase64 or imageId.")
+        return self
+
+class GeneratePromptRequest(ImageReference):
     tags: Optional[List[str]] = None
 
-class TransformImageRequest(BaseModel):
-    imageBase64: str
+class TransformImageRequest(ImageReference):
     prompt: str
     tags: List[str]
     original_filename: str
 
+class BatchItem(GeneratePromptRequest):
+    # Without a prompt, the worker generates one from the image and tags (random tags if none).
+    prompt: Optional[str] = None
+    original_filename: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    label: Optional[str] = None
+    items: List[BatchItem] = Field(min_length=1)
+
 class SetCreatorNameRequest(BaseModel):
     name: str
 
@@ -30,6 +48,9 @@ class GenerationInfo(BaseModel):
     status: JobStatus
     original_image_filename: str
     generated_image_url: Optional[str] = None
+    # Web-optimized WebP versions of generated_image_url; prefer these for display.
+    thumbnail_url: Optional[str] = None
+    display_url: Optional[str] = None
     prompt_text: Optional[str] = None
     tags_used: Optional[List[str]] = None
     creator_name: Optional[str] = None
@@ -47,8 +68,54 @@ class JobStatusResponse(BaseModel):
     error: Optional[str] = None
     generation_data: Optional[GenerationInfo] = None
 
+    @classmethod
+    def from_generation(cls, job: Any) -> "JobStatusResponse":
+        response = cls(status=job.status)
+        if job.status == JobStatus.COMPLETED:
+            # The 'result' field is kept for legacy compatibility if any old logic uses it,
+            # but new logic should rely on the full generation_data object.
+            response.result = job.generated_image_url
+            response.generation_data = GenerationInfo.model_validate(job)
+        elif job.status == JobStatus.FAILED:
+            response.error = "AI transformation failed. See server logs for details."
+        return response
+
+class UploadResponse(BaseModel):
+    image_id: str
+    url: str
+
+class PublicGalleryPage(BaseModel):
+    items: List[GenerationInfo]
+    # Opaque cursor for the next page, None on the last page.
+    next_cursor: Optional[str] = None
+
 class JobCreationResponse(BaseModel):
     job_id: str
+    # Admission control's estimate of the seconds until the result.
+    estimated_wait_seconds: Optional[float] = None
+
+class BatchCreationResponse(BaseModel):
+    batch_id: str
+    job_ids: List[str]
+
+class BatchItemStatus(BaseModel):
+    job_id: str
+    status: JobStatus
+    generated_image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    label: Optional[str] = None
+    created_at: datetime
+    total: int
+    # Items per status; the batch is finished once all are completed or failed.
+    pending: int
+    processing: int
+    completed: int
+    failed: int
+    finished: bool
+    items: List[BatchItemStatus]
 
 class PromptGenerationResponse(BaseModel):
     prompt: str
@@ -57,4 +124,21 @@ class PromptGenerationResponse(BaseModel):
 class GamificationStatsResponse(BaseModel):
     happiness_score: int
     target_score: int
-    deadline_iso: str
\ No newline at end of file
+    deadline_iso: str
+
+class StageLatency(BaseModel):
+    stage: str
+    # Completed jobs that have both timestamps of the stage.
+    count: int
+    # Seconds; None without samples.
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+class JobStatsResponse(BaseModel):
+    window_hours: float
+    completed: int
+    failed: int
+    # Failed jobs per exception class.
+    errors: Dict[str, int]
+    stages: List[StageLatency]
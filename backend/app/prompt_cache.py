@@ -0,0 +1,65 @@
+"""
+Persistent cache of generated prompts, stored in the `prompt_cache` table.
+
+Entries are keyed by the image content hash and the sorted tag set. Each key
+collects up to PROMPT_CACHE_VARIANTS prompts from GPT; after that, requests are
+served from the cache, rotating through the variants least-recently-used first so
+repeat visitors don't keep seeing the same prompt. Entries expire after
+PROMPT_CACHE_TTL_SECONDS and the table is trimmed to PROMPT_CACHE_MAX_ENTRIES by
+last use.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import func, select, delete, update
+
+from . import db_models, database
+from .config import PROMPT_CACHE_VARIANTS, PROMPT_CACHE_TTL_SECONDS, PROMPT_CACHE_MAX_ENTRIES
+
+
+def make_cache_key(image_hash: str, tag_ids: list[str]) -> str:
+    return f"{image_hash}:{','.join(sorted(set(tag_ids)))}"
+
+def _expiry_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=PROMPT_CACHE_TTL_SECONDS)
+
+async def next_variant(cache_key: str) -> Optional[str]:
+    """
+    Returns the least recently used prompt for the key and marks it used, or None while
+    the key has fewer than PROMPT_CACHE_VARIANTS fresh prompts and should get another one.
+    """
+    entry = db_models.PromptCacheEntry
+    # Lookups, misses included, go through the read pool; only a hit takes the write connection.
+    async with database.ReadSessionLocal() as db:
+        variants = (await db.execute(
+            select(entry.id, entry.prompt_text)
+            .where(entry.cache_key == cache_key, entry.created_at >= _expiry_cutoff())
+            .order_by(entry.last_used_at, entry.id)
+            .limit(PROMPT_CACHE_VARIANTS)
+        )).all()
+    if len(variants) < PROMPT_CACHE_VARIANTS:
+        return None
+    chosen_id, prompt_text = variants[0]
+    async with database.SessionLocal() as db:
+        await db.execute(update(entry).where(entry.id == chosen_id).values(last_used_at=func.now()))
+        await db.commit()
+    return prompt_text
+
+async def store(cache_key: str, prompt_text: str):
+    """Adds a freshly generated prompt, then drops expired rows and trims the table to size."""
+    async with database.SessionLocal() as db:
+        db.add(db_models.PromptCacheEntry(cache_key=cache_key, prompt_text=prompt_text))
+        await db.execute(
+            delete(db_models.PromptCacheEntry).where(db_models.PromptCacheEntry.created_at < _expiry_cutoff())
+        )
+        await db.flush()
+
+        overflow = await db.scalar(select(func.count(db_models.PromptCacheEntry.id))) - PROMPT_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            oldest_ids = select(db_models.PromptCacheEntry.id)\
+                .order_by(db_models.PromptCacheEntry.last_used_at, db_models.PromptCacheEntry.id)\
+                .limit(overflow)\
+                .scalar_subquery()
+            await db.execute(
+                delete(db_models.PromptCacheEntry).where(db_models.PromptCacheEntry.id.in_(oldest_ids))
+            )
+        await db.commit()
@@ -0,0 +1,133 @@
+"""
+Async clients for the external AI providers and for downloading their results.
+
+OpenAI, Replicate and plain image downloads all share one pooled keep-alive HTTP
+transport that lives as long as the process: the API starts and closes it in
+`lifespan`, the worker around its job loop. Nothing here blocks the event loop.
+"""
+import httpx
+import openai
+import aiofiles
+import replicate
+from pathlib import Path
+from typing import AsyncIterator
+from replicate.prediction import Prediction
+
+from . import metrics
+from .config import (
+    OPENAI_API_KEY, REPLICATE_API_KEY, PROMPT_MODEL, REPLICATE_MODEL,
+    PROVIDER_MAX_CONNECTIONS, PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+)
+
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+DOWNLOAD_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ProviderClients:
+    def __init__(self):
+        self._transport: httpx.AsyncHTTPTransport | None = None
+        self._http: httpx.AsyncClient | None = None
+        self._openai: openai.AsyncOpenAI | None = None
+        self._replicate: replicate.Client | None = None
+
+    async def start(self):
+        if self._transport is not None:
+            return
+        # One connection pool for every provider; clients only differ in headers and timeouts.
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=PROVIDER_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            retries=1,
+        )
+        self._http = httpx.AsyncClient(transport=self._transport, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
+        # The OpenAI SDK refuses to start without a key; endpoints report the missing key instead.
+        if OPENAI_API_KEY:
+            self._openai = openai.AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                http_client=httpx.AsyncClient(transport=self._transport, timeout=OPENAI_TIMEOUT),
+            )
+        self._replicate = replicate.Client(api_token=REPLICATE_API_KEY, transport=self._transport)
+
+    async def close(self):
+        if self._transport is None:
+            return
+        # Closing the shared transport closes the pooled connections of every client.
+        await self._transport.aclose()
+        self._transport = self._http = self._openai = self._replicate = None
+
+    def _require_started(self):
+        if self._transport is None:
+            raise RuntimeError("Provider clients are not started.")
+
+    def _require_openai(self):
+        self._require_started()
+        if self._openai is None:
+            raise RuntimeError("OpenAI API key not configured.")
+
+    @staticmethod
+    def _prompt_messages(system_prompt: str, image_data_url: str) -> list[dict]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": [{"type": "text", "text": "Generate a prompt for this image."}, {"type": "image_url", "image_url": {"url": image_data_url}}]},
+        ]
+
+    async def generate_prompt(self, system_prompt: str, image_data_url: str) -> str:
+        """Asks the vision model for a transformation prompt for the given image."""
+        self._require_openai()
+        with metrics.timed(metrics.OPENAI_REQUEST_DURATION):
+            response = await self._openai.chat.completions.create(
+                model=PROMPT_MODEL,
+                messages=self._prompt_messages(system_prompt, image_data_url),
+                max_tokens=500,
+            )
+        return response.choices[0].message.content.strip()
+
+    async def stream_prompt(self, system_prompt: str, image_data_url: str) -> AsyncIterator[str]:
+        """Like generate_prompt, but yields the prompt's text piece by piece as the model writes it."""
+        self._require_openai()
+        with metrics.timed(metrics.OPENAI_REQUEST_DURATION):
+            stream = await self._openai.chat.completions.create(
+                model=PROMPT_MODEL,
+                messages=self._prompt_messages(system_prompt, image_data_url),
+                max_tokens=500,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def create_prediction(self, prompt: str, image_data_url: str) -> Prediction:
+        """Submits an image transformation to Replicate and returns the pending prediction."""
+        self._require_started()
+        input_data = {"prompt": prompt, "input_image": image_data_url, "output_format": "png"}
+        with metrics.timed(metrics.REPLICATE_STAGE_DURATION, stage="create"):
+            return await self._replicate.predictions.async_create(model=REPLICATE_MODEL, input=input_data)
+
+    async def get_prediction(self, prediction_id: str) -> Prediction:
+        """Fetches an existing prediction, e.g. one started before the worker restarted."""
+        self._require_started()
+        return await self._replicate.predictions.async_get(prediction_id)
+
+    async def wait_for_prediction(self, prediction: Prediction) -> Prediction:
+        """Polls the prediction without blocking until it has succeeded, failed or been canceled."""
+        self._require_started()
+        with metrics.timed(metrics.REPLICATE_STAGE_DURATION, stage="wait") as outcome:
+            await prediction.async_wait()
+            outcome["outcome"] = prediction.status # succeeded, failed or canceled
+        return prediction
+
+    async def download(self, url: str, save_path: Path):
+        """Streams a remote file to disk. Raises httpx.HTTPError on network or status errors."""
+        self._require_started()
+        with metrics.timed(metrics.REPLICATE_STAGE_DURATION, stage="download"):
+            async with self._http.stream("GET", url) as response:
+                response.raise_for_status()
+                async with aiofiles.open(save_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+
+
+providers = ProviderClients()
@@ -0,0 +1,270 @@
+"""
+Background thumbnail pipeline and the persisted asset manifest.
+
+Every gallery image gets responsive thumbnails in several sizes, each as WebP and
+JPEG. Rendering runs in a process pool so neither startup nor uploads wait for it:
+`lifespan` only schedules a reconcile task, and uploads are queued as they arrive.
+
+`THUMBNAILS_DIR/manifest.json` describes every source image, keyed by filename: the
+size and mtime it was last processed at, its sha256, its dimensions (after EXIF
+rotation) and the thumbnail files derived from it. The gallery is served from the
+manifest alone. After a restart the reconcile task compares it with IMAGES_DIR and
+only touches what differs: new or changed images are rendered, entries written before
+hashes and dimensions were recorded are completed, and removed images are dropped.
+With several uvicorn workers, only the worker that acquires the reconcile lock scans
+the library; the manifest itself is guarded by a separate file lock for the short
+read-modify-write of each update.
+
+Generated images get their WebP derivatives from `render_generation_derivatives`,
+called by the worker when a job completes; their paths are stored on the row.
+"""
+import os
+import json
+import fcntl
+import asyncio
+import hashlib
+import multiprocessing
+from pathlib import Path
+from typing import Callable, Optional
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from PIL import ExifTags, Image, ImageOps
+
+from .config import (
+    IMAGES_DIR, THUMBNAILS_DIR, ALLOWED_EXTENSIONS, THUMBNAIL_SIZES, LEGACY_THUMBNAIL_SIZE, THUMBNAIL_WORKERS,
+    GENERATED_THUMBNAIL_SIZE, GENERATED_DISPLAY_SIZE,
+)
+
+MANIFEST_PATH = THUMBNAILS_DIR / "manifest.json"
+MANIFEST_LOCK_PATH = THUMBNAILS_DIR / ".manifest.lock"
+MANIFEST_VERSION = 2
+RECONCILE_LOCK_PATH = THUMBNAILS_DIR / ".reconcile.lock"
+
+# Pillow save options per output format.
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+
+def thumbnail_filename(stem: str, size: int, fmt: str) -> str:
+    # The 400px JPEG keeps the original `{stem}.jpeg` name that /api/gallery has always returned.
+    if size == LEGACY_THUMBNAIL_SIZE and fmt == "jpeg":
+        return f"{stem}.jpeg"
+    return f"{stem}-{size}.{fmt}"
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def describe_image(image_path: str) -> dict:
+    """
+    Returns the manifest fields that describe an image file itself, without rendering
+    anything: size, mtime, sha256 and the dimensions it is displayed at. Only the image
+    header is decoded. Runs inside a pool process.
+    """
+    source = Path(image_path)
+    stat = source.stat()
+    with Image.open(source) as img:
+        width, height = img.size
+        # Orientations 5-8 are rotated by 90 degrees.
+        if img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            width, height = height, width
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _file_sha256(source),
+            "width": width, "height": height}
+
+def render_thumbnails(image_path: str, thumbnails_dir: str) -> dict:
+    """
+    Renders every size and format for one image and returns its manifest entry.
+    Runs inside a pool process, so it only takes and returns plain, picklable values.
+    """
+    source = Path(image_path)
+    stat = source.stat()
+    variants: dict[str, dict[str, str]] = {}
+    legacy = None
+    with Image.open(source) as img:
+        working = ImageOps.exif_transpose(img)
+        if working.mode != "RGB":
+            working = working.convert("RGB")
+        width, height = working.size
+        # Shrink the same working copy step by step, which is cheaper than resizing from the original each time.
+        for size in sorted(THUMBNAIL_SIZES, reverse=True):
+            working.thumbnail((size, size))
+            variants[str(size)] = {}
+            for fmt, (pil_format, options) in THUMBNAIL_FORMATS.items():
+                filename = thumbnail_filename(source.stem, size, fmt)
+                variants[str(size)][fmt] = filename
+                if filename == f"{source.stem}.jpeg":
+                    legacy = working.copy()
+                    continue
+                working.save(Path(thumbnails_dir) / filename, pil_format, **options)
+    # The legacy thumbnail is written last: the gallery lists an image as soon as it exists.
+    if legacy is not None:
+        pil_format, options = THUMBNAIL_FORMATS["jpeg"]
+        legacy.save(Path(thumbnails_dir) / f"{source.stem}.jpeg", pil_format, **options)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _file_sha256(source),
+            "width": width, "height": height, "variants": variants}
+
+def render_generation_derivatives(image_path: Path) -> dict[str, str]:
+    """
+    Writes a card thumbnail and a display-sized copy of a generated image as WebP next to
+    it. Returns their paths relative to IMAGES_DIR, keyed "thumbnail" and "display".
+    """
+    pil_format, options = THUMBNAIL_FORMATS["webp"]
+    derivatives = {}
+    with Image.open(image_path) as img:
+        working = img.convert("RGB") if img.mode != "RGB" else img.copy()
+        for name, size in (("display", GENERATED_DISPLAY_SIZE), ("thumbnail", GENERATED_THUMBNAIL_SIZE)):
+            working.thumbnail((size, size))
+            derivative_path = image_path.with_name(f"{image_path.stem}-{name}.webp")
+            working.save(derivative_path, pil_format, **options)
+            derivatives[name] = derivative_path.relative_to(IMAGES_DIR).as_posix()
+    return derivatives
+
+
+# --- Manifest ---
+
+@contextmanager
+def _file_lock(path: Path, blocking: bool = True):
+    with open(path, "a") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_manifest(path: Path = MANIFEST_PATH) -> dict[str, dict]:
+    try:
+        with open(path) as f:
+            return json.load(f).get("images", {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def record_in_manifest(entries: dict[str, dict], removed: tuple[str, ...] = ()):
+    """
+    Merges entries field by field into the manifest and drops the `removed` images,
+    written atomically under the manifest lock.
+    """
+    with _file_lock(MANIFEST_LOCK_PATH):
+        images = load_manifest()
+        for name, entry in entries.items():
+            images[name] = {**images.get(name, {}), **entry}
+        for name in removed:
+            images.pop(name, None)
+        tmp_path = MANIFEST_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "images": images}, f)
+        tmp_path.replace(MANIFEST_PATH)
+
+def _compare_library() -> tuple[list[Path], list[Path], list[str]]:
+    """
+    Compares IMAGES_DIR with the manifest. Returns the images to render (new, changed or
+    never rendered), those only missing their hash or dimensions, and the names of
+    entries whose image is gone.
+    """
+    manifest = load_manifest()
+    to_render, to_describe, present = [], [], set()
+    with os.scandir(IMAGES_DIR) as entries:
+        for dir_entry in entries:
+            if not dir_entry.is_file() or Path(dir_entry.name).suffix.lower() not in ALLOWED_EXTENSIONS:
+                continue
+            present.add(dir_entry.name)
+            entry = manifest.get(dir_entry.name)
+            stat = dir_entry.stat()
+            if entry is None or entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns \
+                    or not entry.get("variants"):
+                to_render.append(Path(dir_entry.path))
+            elif "sha256" not in entry or "width" not in entry:
+                to_describe.append(Path(dir_entry.path))
+    removed = [name for name in manifest if name not in present]
+    return sorted(to_render), sorted(to_describe), removed
+
+
+# --- Pipeline ---
+
+class ThumbnailPipeline:
+    def __init__(self, workers: int = THUMBNAIL_WORKERS):
+        self._workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        """Starts the pool and schedules reconciling the library without waiting for it."""
+        if self._pool is None:
+            # 'spawn' avoids forking a process that already runs an event loop and threads.
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+            self._track(asyncio.create_task(self._reconcile()))
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, image_path: Path, on_done: Optional[Callable[[Path, dict], None]] = None):
+        """Queues thumbnails for one image and returns immediately. `on_done` runs once they exist."""
+        self._track(asyncio.create_task(self._render_and_record([image_path], on_done)))
+
+    def _track(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _render(self, image_path: Path) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, render_thumbnails, str(image_path), str(THUMBNAILS_DIR))
+        except Exception as e:
+            print(f"Error creating thumbnails for {image_path.name}: {e}")
+            return None
+
+    async def _describe(self, image_path: Path) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, describe_image, str(image_path))
+        except Exception as e:
+            print(f"Error describing {image_path.name}: {e}")
+            return None
+
+    async def _render_and_record(self, image_paths: list[Path], on_done=None):
+        results = await asyncio.gather(*(self._render(path) for path in image_paths))
+        entries = {path.name: entry for path, entry in zip(image_paths, results) if entry is not None}
+        if entries:
+            await asyncio.to_thread(record_in_manifest, entries)
+        if on_done is not None:
+            for path in image_paths:
+                if path.name in entries:
+                    on_done(path, entries[path.name])
+
+    async def _reconcile(self, batch_size: int = 32):
+        with _file_lock(RECONCILE_LOCK_PATH, blocking=False) as acquired:
+            if not acquired:
+                return # Another uvicorn worker is already doing it.
+            to_render, to_describe, removed = await asyncio.to_thread(_compare_library)
+            if not (to_render or to_describe or removed):
+                return
+            print(f"Reconciling the asset manifest in the background: {len(to_render)} image(s) to render, "
+                  f"{len(to_describe)} to describe, {len(removed)} removed...")
+            if removed:
+                await asyncio.to_thread(record_in_manifest, {}, tuple(removed))
+            # Record in batches so progress survives a restart without rewriting the manifest per image.
+            for start in range(0, len(to_render), batch_size):
+                await self._render_and_record(to_render[start:start + batch_size])
+            for start in range(0, len(to_describe), batch_size):
+                paths = to_describe[start:start + batch_size]
+                results = await asyncio.gather(*(self._describe(path) for path in paths))
+                entries = {path.name: entry for path, entry in zip(paths, results) if entry is not None}
+                if entries:
+                    await asyncio.to_thread(record_in_manifest, entries)
+            print("Asset manifest reconciled.")
+
+thumbnail_pipeline = ThumbnailPipeline()
@@ -0,0 +1,60 @@
+"""
+Voting, shared by every API worker through the database.
+
+A vote is one short transaction: an atomic `votes = votes + 1` UPDATE on the generation,
+a conditional upsert into `vote_rate_limits` that only succeeds if the client's last
+vote is older than VOTE_RATE_LIMIT_SECONDS, and, for visible generations, the
+happiness score counter (see gamification.py). Nothing is read and written back, so
+concurrent votes can't overwrite each other, and the limit holds however many workers
+serve the API. Expired rate-limit rows are purged periodically to keep the table small.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import update, delete, Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models, database
+from .config import VOTE_RATE_LIMIT_SECONDS
+
+_last_purge = 0.0
+
+
+def _rate_limit_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=VOTE_RATE_LIMIT_SECONDS)
+
+async def add_vote(db: AsyncSession, job_id: str) -> Optional[Row]:
+    """
+    Increments the generation's votes in place. Returns its new `votes` and `is_visible`,
+    or None if it doesn't exist.
+    """
+    result = await db.execute(
+        update(db_models.Generation)
+        .where(db_models.Generation.id == job_id)
+        .values(votes=db_models.Generation.votes + 1)
+        .returning(db_models.Generation.votes, db_models.Generation.is_visible)
+    )
+    return result.first()
+
+async def try_acquire_vote_slot(db: AsyncSession, client_key: str) -> bool:
+    """
+    Records a vote by the client unless it already voted within the rate limit window.
+    Returns False when rate limited. Like add_vote, it leaves committing to the caller.
+    """
+    table = db_models.VoteRateLimit.__table__
+    statement = database.dialect_insert(table).values(client_key=client_key, last_vote_at=datetime.now(timezone.utc))
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.client_key],
+        set_={"last_vote_at": statement.excluded.last_vote_at},
+        where=table.c.last_vote_at < _rate_limit_cutoff(),
+    )
+    return (await db.execute(statement)).rowcount == 1
+
+async def purge_expired_rate_limits(db: AsyncSession):
+    """Deletes rate limit rows that no longer limit anyone, at most once per window per process."""
+    global _last_purge
+    if time.monotonic() - _last_purge < VOTE_RATE_LIMIT_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    await db.execute(delete(db_models.VoteRateLimit).where(db_models.VoteRateLimit.last_vote_at < _rate_limit_cutoff()))
+    await db.commit()
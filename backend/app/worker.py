@@ -0,0 +1,424 @@
+"""
+Standalone worker process for image transformations.
+
+The API only records a PENDING `Generation` row; this process claims those rows
+atomically and runs the long Replicate predictions, so request-serving uvicorn
+workers never block a thread for the duration of a job. Jobs survive API restarts
+because the queue lives in the database.
+
+Jobs also survive the worker itself: a claim is a lease that the worker keeps
+renewing while it runs the job, and the Replicate prediction id is stored as soon as
+the prediction exists. When a worker dies, any worker picks up its jobs once their
+leases run out, reattaching to the prediction instead of paying for a new one. Only
+jobs that never got a prediction go back to the queue.
+
+Batch items (POST /api/batches) wait while visitors' jobs are queued, and are paced by
+the provider budgets in budgets.py.
+
+Run with: python -m app.worker
+"""
+import os
+import uuid
+import signal
+import socket
+import asyncio
+import httpx
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import and_, func, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import db_models, database, http_cache, prompt_cache
+from .ai_prompts import TAG_IDS_BY_NAME, create_system_prompt
+from .budgets import openai_batch_budget, replicate_batch_budget
+from .config import (
+    IMAGES_DIR, GENERATED_IMAGES_DIR, WORKER_CONCURRENCY, WORKER_POLL_INTERVAL_SECONDS, WORKER_LEASE_SECONDS,
+    REPLICATE_IMAGE_MAX_DIMENSION, OPENAI_IMAGE_MAX_DIMENSION, BATCH_MAX_IN_FLIGHT,
+)
+from .images import resolve_image_to_data_url, image_content_hash
+from .providers import providers
+from .thumbnails import render_generation_derivatives
+
+
+# Identifies this process in `claimed_by`; unique across containers and restarts.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# Arbitrary, fixed id of the PostgreSQL advisory lock that serializes batch claims.
+BATCH_CLAIM_LOCK_KEY = 2076
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _lease_expiry() -> datetime:
+    return _now() + timedelta(seconds=WORKER_LEASE_SECONDS)
+
+def _oldest_pending(batch: bool):
+    generation = db_models.Generation
+    return (
+        select(generation.id)
+        .where(generation.status == db_models.JobStatus.PENDING,
+               generation.batch_id.isnot(None) if batch else generation.batch_id.is_(None))
+        .order_by(generation.priority.desc(), generation.created_at)
+        .limit(1)
+    )
+
+def _batch_slot_free():
+    """True while fewer than BATCH_MAX_IN_FLIGHT batch items are PROCESSING, counted across all workers."""
+    generation = db_models.Generation
+    in_flight = (
+        select(func.count()).select_from(generation)
+        .where(generation.status == db_models.JobStatus.PROCESSING, generation.batch_id.isnot(None))
+        .scalar_subquery()
+    )
+    return in_flight < BATCH_MAX_IN_FLIGHT
+
+async def claim_next_job(db: AsyncSession) -> Optional[str]:
+    """
+    Moves the oldest PENDING generation to PROCESSING and returns its id, or None if the
+    queue is empty or another worker won the race. The conditional UPDATE is what makes
+    the claim atomic across processes: only one of them can match `status == PENDING`.
+    Visitors' jobs go first, kiosks' before the public's (see admission.py); batch items
+    are only claimed while a batch slot is free. Counting the slots inside the UPDATE only
+    holds the cap while claims are serialized: SQLite's single writer does that, and on
+    PostgreSQL batch claims take an advisory lock until they commit, so the next claim's
+    count sees the last one.
+    """
+    conditions = []
+    candidate_id = await db.scalar(_oldest_pending(batch=False))
+    if not candidate_id:
+        if database.engine.dialect.name == "postgresql":
+            await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": BATCH_CLAIM_LOCK_KEY})
+        conditions.append(_batch_slot_free())
+        candidate_id = await db.scalar(_oldest_pending(batch=True).where(*conditions))
+    if not candidate_id:
+        return None
+
+    claimed = await db.execute(
+        update(db_models.Generation)
+        .where(db_models.Generation.id == candidate_id, db_models.Generation.status == db_models.JobStatus.PENDING,
+               *conditions)
+        .values(status=db_models.JobStatus.PROCESSING, claimed_at=_now(), claimed_by=WORKER_ID,
+                lease_expires_at=_lease_expiry())
+    )
+    await db.commit()
+    return candidate_id if claimed.rowcount else None
+
+async def _load_job(job_id: str) -> Optional[db_models.Generation]:
+    async with database.ReadSessionLocal() as db:
+        return await db.get(db_models.Generation, job_id)
+
+async def _update_job(job_id: str, owned: bool = True, **values) -> bool:
+    """
+    Writes job fields in one short transaction. Jobs never hold a session while waiting on
+    Replicate, so the process's single write connection is only busy for the update itself.
+    With `owned`, only writes while this worker still holds the job, and returns whether it did.
+    """
+    statement = update(db_models.Generation).where(db_models.Generation.id == job_id)
+    if owned:
+        statement = statement.where(db_models.Generation.claimed_by == WORKER_ID)
+    async with database.SessionLocal() as db:
+        result = await db.execute(statement.values(**values))
+        # Completing a job or adding its derivatives changes what the public gallery returns.
+        if result.rowcount and (values.get("status") == db_models.JobStatus.COMPLETED or "thumbnail_url" in values):
+            await http_cache.bump_version(db, http_cache.PUBLIC_GALLERY)
+        await db.commit()
+    return bool(result.rowcount)
+
+async def run_ai_transformation_task(job_id: str):
+    """
+    Runs a claimed job to completion: sends the source image and prompt to Replicate,
+    downloads the generated image and saves it locally. Batch items first get their
+    prompt if they have none, and wait for the batch budgets before calling a provider. Each stage's end is recorded on
+    the row for /api/job-stats; the prediction id is stored as soon as it exists, and a
+    job that already has one (taken over from a dead worker) continues that prediction.
+    """
+    job = await _load_job(job_id)
+    if not job:
+        print(f"[{job_id}] ERROR: Generation record not found in DB.")
+        return
+    # Rows queued before `source_image_path` existed fall back to the original filename.
+    source_image = job.source_image_path or job.original_image_filename
+    prompt_text = job.prompt_text
+    timeline = {}
+
+    try:
+        if job.replicate_prediction_id:
+            print(f"[{job_id}] Resuming Replicate prediction {job.replicate_prediction_id}...")
+            prediction = await providers.get_prediction(job.replicate_prediction_id)
+        else:
+            if job.batch_id:
+                if not prompt_text:
+                    prompt_text = await _generate_batch_prompt(job_id, source_image, job.tags_used or [])
+                    if not await _update_job(job_id, prompt_text=prompt_text):
+                        print(f"[{job_id}] Job was taken over by another worker, leaving it.")
+                        return
+                await replicate_batch_budget.take()
+
+            image_data_url = await asyncio.to_thread(
+                resolve_image_to_data_url, f"/api/images/{source_image}", REPLICATE_IMAGE_MAX_DIMENSION
+            )
+
+            print(f"[{job_id}] Starting Replicate prediction...")
+            prediction = await providers.create_prediction(prompt_text, image_data_url)
+            if not await _update_job(job_id, replicate_prediction_id=prediction.id, prediction_created_at=_now()):
+                print(f"[{job_id}] Job was taken over by another worker, leaving it.")
+                return
+        await providers.wait_for_prediction(prediction)
+        # The remaining stage times are written with the job's final update.
+        timeline["prediction_finished_at"] = _now()
+
+        if prediction.status != "succeeded":
+            raise ValueError(f"Prediction failed. Status: {prediction.status}. Error: {prediction.error}")
+
+        if not prediction.output or not isinstance(prediction.output, str):
+            raise ValueError(f"Model returned invalid output: {prediction.output}")
+
+        print(f"[{job_id}] Prediction successful. Downloading image...")
+
+        replicate_url = prediction.output
+        try:
+            file_extension = Path(replicate_url).suffix or '.png'
+            local_filename = f"{uuid.uuid4()}{file_extension}"
+            save_path = GENERATED_IMAGES_DIR / local_filename
+
+            await providers.download(replicate_url, save_path)
+            timeline["downloaded_at"] = _now()
+
+            print(f"[{job_id}] Image saved to {save_path}")
+            if not await _update_job(
+                job_id,
+                generated_image_url=f"generated/{local_filename}", # Store relative path
+                status=db_models.JobStatus.COMPLETED,
+                finished_at=_now(),
+                **timeline,
+            ):
+                return
+            # The visitor already has the result; the gallery falls back to the full image
+            # until the WebP versions are written.
+            derivatives = await _render_derivatives(job_id, save_path)
+            if derivatives:
+                await _update_job(job_id, owned=False, **derivatives)
+
+        except httpx.HTTPError as e:
+            raise IOError(f"Failed to download image from Replicate: {e}") from e
+
+    except Exception as e:
+        print(f"[{job_id}] --- DETAILED AI TASK ERROR ---")
+        print(f"[{job_id}] Error Type: {type(e).__name__}")
+        print(f"[{job_id}] Error Details: {e}")
+        print(f"[{job_id}] --------------------------------")
+        await _update_job(
+            job_id, status=db_models.JobStatus.FAILED, finished_at=_now(), error_type=type(e).__name__, **timeline
+        )
+
+async def _generate_batch_prompt(job_id: str, source_image: str, tag_names: list[str]) -> str:
+    """
+    Gets a prompt for a batch item the way /api/generate-prompt does, from the prompt
+    cache or else from the vision model, paced by the batch OpenAI budget.
+    """
+    tag_ids = [TAG_IDS_BY_NAME[name] for name in tag_names if name in TAG_IDS_BY_NAME]
+    image_string = f"/api/images/{source_image}"
+    image_hash = await asyncio.to_thread(image_content_hash, image_string)
+    cache_key = prompt_cache.make_cache_key(image_hash, tag_ids)
+    prompt = await prompt_cache.next_variant(cache_key)
+    if prompt:
+        return prompt
+
+    await openai_batch_budget.take()
+    print(f"[{job_id}] Generating prompt for batch item...")
+    image_data_url = await asyncio.to_thread(resolve_image_to_data_url, image_string, OPENAI_IMAGE_MAX_DIMENSION, image_hash)
+    prompt = await providers.generate_prompt(create_system_prompt(tag_ids), image_data_url)
+    await prompt_cache.store(cache_key, prompt)
+    return prompt
+
+async def _render_derivatives(job_id: str, image_path: Path) -> dict[str, str]:
+    """
+    Renders the WebP thumbnail/display versions and returns them as Generation fields.
+    A failure here must not fail the job, so it returns no fields instead.
+    """
+    try:
+        derivatives = await asyncio.to_thread(render_generation_derivatives, image_path)
+    except Exception as e:
+        print(f"[{job_id}] Could not render derivatives for {image_path.name}: {e}")
+        return {}
+    return {"thumbnail_url": derivatives["thumbnail"], "display_url": derivatives["display"]}
+
+async def _find_generations_missing_derivatives() -> list[tuple[str, str]]:
+    async with database.ReadSessionLocal() as db:
+        rows = await db.execute(
+            select(db_models.Generation.id, db_models.Generation.generated_image_url)
+            .where(db_models.Generation.status == db_models.JobStatus.COMPLETED,
+                   db_models.Generation.generated_image_url.isnot(None),
+                   db_models.Generation.display_url.is_(None))
+        )
+        return [tuple(row) for row in rows]
+
+async def backfill_generation_tags(batch_size: int = 500):
+    """Indexes the tags of generations created before generation_tags existed."""
+    generation, generation_tag = db_models.Generation, db_models.GenerationTag
+    async with database.ReadSessionLocal() as db:
+        rows = (await db.execute(
+            select(generation.id, generation.tags_used)
+            .where(~select(generation_tag.generation_id).where(generation_tag.generation_id == generation.id).exists())
+        )).all()
+    tag_rows = [
+        {"generation_id": generation_id, "tag_id": TAG_IDS_BY_NAME[name]}
+        for generation_id, tag_names in rows for name in dict.fromkeys(tag_names or []) if name in TAG_IDS_BY_NAME
+    ]
+    if not tag_rows:
+        return
+    print(f"Indexing {len(tag_rows)} tag(s) of earlier generations...")
+    for start in range(0, len(tag_rows), batch_size):
+        async with database.SessionLocal() as db:
+            await db.execute(
+                database.dialect_insert(generation_tag).values(tag_rows[start:start + batch_size]).on_conflict_do_nothing()
+            )
+            await db.commit()
+
+async def backfill_generation_derivatives():
+    """Renders derivatives for generations completed before they existed, one at a time."""
+    missing = await _find_generations_missing_derivatives()
+    if missing:
+        print(f"Rendering derivatives for {len(missing)} generated image(s) in the background...")
+    for job_id, generated_image_url in missing:
+        image_path = IMAGES_DIR / generated_image_url
+        if not image_path.is_file():
+            continue
+        derivatives = await _render_derivatives(job_id, image_path)
+        if derivatives:
+            await _update_job(job_id, owned=False, **derivatives)
+
+async def _backfill():
+    await backfill_generation_tags()
+    await backfill_generation_derivatives()
+
+
+# --- Leases & Recovery ---
+
+async def renew_leases():
+    """Extends the lease of every job this worker is running, with one UPDATE per interval."""
+    while True:
+        await asyncio.sleep(WORKER_LEASE_SECONDS / 3)
+        try:
+            async with database.SessionLocal() as db:
+                await db.execute(
+                    update(db_models.Generation)
+                    .where(db_models.Generation.claimed_by == WORKER_ID,
+                           db_models.Generation.status == db_models.JobStatus.PROCESSING)
+                    .values(lease_expires_at=_lease_expiry())
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"Could not renew job leases: {e}")
+
+def _abandoned(now: datetime):
+    """PROCESSING jobs whose worker stopped renewing them. Jobs claimed before leases existed count after one lease period."""
+    generation = db_models.Generation
+    return and_(
+        generation.status == db_models.JobStatus.PROCESSING,
+        or_(
+            generation.lease_expires_at < now,
+            and_(generation.lease_expires_at.is_(None),
+                 or_(generation.claimed_at.is_(None), generation.claimed_at < now - timedelta(seconds=WORKER_LEASE_SECONDS))),
+        ),
+    )
+
+async def recover_abandoned_jobs() -> list[str]:
+    """
+    Takes over the jobs of workers that died. Jobs with a Replicate prediction are claimed
+    by this worker and returned, to be resumed; the others go back to the queue. Both are
+    conditional UPDATEs, so each abandoned job is recovered by exactly one worker.
+    """
+    now = _now()
+    async with database.SessionLocal() as db:
+        resumed = (await db.scalars(
+            update(db_models.Generation)
+            .where(_abandoned(now), db_models.Generation.replicate_prediction_id.isnot(None))
+            .values(claimed_by=WORKER_ID, lease_expires_at=_lease_expiry())
+            .returning(db_models.Generation.id)
+        )).all()
+        requeued = (await db.scalars(
+            update(db_models.Generation)
+            .where(_abandoned(now), db_models.Generation.replicate_prediction_id.is_(None))
+            .values(status=db_models.JobStatus.PENDING, claimed_at=None, claimed_by=None, lease_expires_at=None)
+            .returning(db_models.Generation.id)
+        )).all()
+        await db.commit()
+    for job_id in requeued:
+        print(f"[{job_id}] Worker was lost before the prediction started; job re-queued.")
+    return list(resumed)
+
+
+# --- Worker Loop ---
+
+async def _claim_next_job_in_new_session() -> Optional[str]:
+    async with database.SessionLocal() as db:
+        return await claim_next_job(db)
+
+async def _process_job(job_id: str, slots: asyncio.Semaphore):
+    try:
+        await run_ai_transformation_task(job_id)
+    finally:
+        slots.release()
+
+async def run_worker(concurrency: int = WORKER_CONCURRENCY):
+    """
+    Claims and runs jobs with at most `concurrency` in flight, and periodically takes over
+    jobs abandoned by dead workers. On SIGINT/SIGTERM it stops claiming new jobs and waits
+    for the running ones to finish.
+    """
+    print(f"Worker starting with concurrency {concurrency}...")
+    await database.init_db()
+    await http_cache.seed_versions()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await providers.start()
+    slots = asyncio.Semaphore(concurrency)
+    in_flight: set[asyncio.Task] = set()
+    backfill = asyncio.create_task(_backfill())
+    lease_renewal = asyncio.create_task(renew_leases())
+    next_recovery = 0.0
+
+    def start_job(job_id: str):
+        task = asyncio.create_task(_process_job(job_id, slots))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    while not stop_event.is_set():
+        if loop.time() >= next_recovery:
+            next_recovery = loop.time() + WORKER_LEASE_SECONDS / 2
+            for job_id in await recover_abandoned_jobs():
+                await slots.acquire()
+                print(f"[{job_id}] Took over job from a lost worker.")
+                start_job(job_id)
+
+        await slots.acquire()
+        job_id = await _claim_next_job_in_new_session()
+        if job_id is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=WORKER_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        print(f"[{job_id}] Claimed job.")
+        start_job(job_id)
+
+    backfill.cancel()
+    if in_flight:
+        print(f"Worker stopping, waiting for {len(in_flight)} running job(s)...")
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    lease_renewal.cancel()
+    await providers.close()
+    await database.close_db()
+    print("Worker stopped.")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
@@ -0,0 +1,136 @@
+"""
+Local stand-ins for the OpenAI and Replicate APIs, so benchmarks need no network or keys.
+
+Implements just what app/providers.py uses: chat completions (also streamed), creating a model
+prediction, polling it and downloading its output. Every call takes the configured
+latency (with +/-25% jitter) and fails with the configured probability.
+
+Run with: python -m benchmarks.fake_providers --port 8765
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 and
+REPLICATE_BASE_URL=http://127.0.0.1:8765.
+"""
+import io
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import uvicorn
+from typing import Optional
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+
+def _render_output_image(size: int) -> bytes:
+    # Noise doesn't compress, which makes the PNG about as large as a real generated image.
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 48).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+def create_app(openai_latency: float = 1.5, replicate_latency: float = 8.0, download_latency: float = 0.2,
+               failure_rate: float = 0.0, output_size: int = 1024, seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    output_png = _render_output_image(output_size)
+    # prediction id -> (time it finishes, whether it fails, input)
+    predictions: dict[str, tuple[float, bool, dict]] = {}
+
+    def jittered(latency: float) -> float:
+        return latency * rng.uniform(0.75, 1.25)
+
+    def fails() -> bool:
+        return rng.random() < failure_rate
+
+    def prediction_json(request: Request, prediction_id: str) -> dict:
+        finishes_at, failed, prediction_input = predictions[prediction_id]
+        status = "processing"
+        if time.monotonic() >= finishes_at:
+            status = "failed" if failed else "succeeded"
+        base_url = str(request.base_url).rstrip("/")
+        return {
+            "id": prediction_id, "model": "fake/model", "version": "fake", "status": status,
+            "input": prediction_input, "logs": "", "metrics": {}, "created_at": None, "started_at": None,
+            "completed_at": None,
+            "output": f"{base_url}/files/{prediction_id}.png" if status == "succeeded" else None,
+            "error": "Fake prediction failure" if status == "failed" else None,
+            "urls": {"get": f"{base_url}/v1/predictions/{prediction_id}"},
+        }
+
+    def completion_text() -> str:
+        return f"A benchmark prompt describing the scene in year 2075, variant {rng.randint(0, 10**6)}."
+
+    async def completion_chunks(total_latency: float):
+        # About a third of the time passes before the first token, like a real model.
+        words = completion_text().split(" ")
+        await asyncio.sleep(total_latency / 3)
+        for index, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": word if index == 0 else f" {word}"}}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(total_latency * 2 / 3 / len(words))
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            if fails():
+                return JSONResponse({"error": {"message": "Fake OpenAI failure", "type": "server_error"}}, status_code=500)
+            return StreamingResponse(completion_chunks(jittered(openai_latency)), media_type="text/event-stream")
+        await asyncio.sleep(jittered(openai_latency))
+        if fails():
+            return JSONResponse({"error": {"message": "Fake OpenAI failure", "type": "server_error"}}, status_code=500)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": completion_text()}}],
+        }
+
+    @app.post("/v1/models/{owner}/{name}/predictions", status_code=201)
+    async def create_prediction(owner: str, name: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(jittered(0.3))
+        if fails():
+            return JSONResponse({"detail": "Fake Replicate failure"}, status_code=500)
+        prediction_id = uuid.uuid4().hex
+        # Don't keep the base64 image around; only the shape of the input matters.
+        predictions[prediction_id] = (time.monotonic() + jittered(replicate_latency), fails(),
+                                      {"prompt": body.get("input", {}).get("prompt")})
+        return prediction_json(request, prediction_id)
+
+    @app.get("/v1/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str, request: Request):
+        if prediction_id not in predictions:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        return prediction_json(request, prediction_id)
+
+    @app.get("/files/{name}")
+    async def download(name: str):
+        await asyncio.sleep(jittered(download_latency))
+        return Response(content=output_png, media_type="image/png")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--openai-latency", type=float, default=1.5, help="Seconds per prompt generation.")
+    parser.add_argument("--replicate-latency", type=float, default=8.0, help="Seconds until a prediction finishes.")
+    parser.add_argument("--download-latency", type=float, default=0.2, help="Seconds before the output download starts.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that any single call fails.")
+    parser.add_argument("--output-size", type=int, default=1024, help="Edge length of the generated PNG.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    app = create_app(args.openai_latency, args.replicate_latency, args.download_latency, args.failure_rate,
+                     args.output_size, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,9 @@ function App() {
     comparisonMode,
     generationDetails,
     modalItem,
-    communityGalleryItems
+    communityGalleryItems,
+    communityGalleryCursor,
+    communityGalleryFilter
   } = useStore();
 
   const showGalleryBackground = (view === 'transform' || view === 'comparison') && !isCommunityItem;
@@ -100,6 +102,11 @@ function App() {
             onItemSelect={handlers.handleModalOpen}
             onModalClose={handlers.handleModalClose}
             fetchGallery={handlers.fetchCommunityGallery}
+            hasMore={communityGalleryCursor !== null}
+            onLoadMore={handlers.loadMoreCommunityGallery}
+            tags={availableTags}
+            filter={communityGalleryFilter}
+            onFilterChange={handlers.setCommunityGalleryFilter}
         />
       </main>
       
@@ -4,6 +4,7 @@ import { TextureLoader, Vector2, Texture } from "three";
 import { API_BASE_URL, GALLERY_CONFIG } from "../../config";
 import ImageNode from "./ImageNode";
 import type { GalleryImage } from "../../types";
+import { galleryThumbnailFile } from "../../utils";
 
 interface DynamicGalleryProps {
   images: GalleryImage[];
@@ -18,7 +19,7 @@ const DynamicGallery: React.FC<DynamicGalleryProps> = ({
 }) => {
   const textures = useLoader(
     TextureLoader,
-    images.map((img) => `${API_BASE_URL}/thumbnails/${img.thumbnail}`)
+    images.map((img) => `${API_BASE_URL}/thumbnails/${galleryThumbnailFile(img)}`)
   );
   const { viewport } = useThree();
 
@@ -85,7 +85,8 @@ const ComparisonView: React.FC<ComparisonViewProps> = ({ generationDetails, sour
     if (!generationDetails) return null;
     
     const originalImageUrl = sourceImage?.url || `${API_BASE_URL}/images/${generationDetails.original_image_filename}`;
-    const outputImageUrl = generationDetails.generated_image_url ? `${API_BASE_URL}/images/${generationDetails.generated_image_url}` : '';
+    const outputImageFile = generationDetails.display_url || generationDetails.generated_image_url;
+    const outputImageUrl = outputImageFile ? `${API_BASE_URL}/images/${outputImageFile}` : '';
     
     const viewWrapperStyle = {
         transform: mode === 'slider' ? `scale(${SLIDER_VIEW_SCALE_FACTOR})` : 'scale(1)',
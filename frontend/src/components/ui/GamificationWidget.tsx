@@ -22,10 +22,31 @@ const GamificationWidget: React.FC = () => {
         }
     }, []);
 
+    // Score updates are pushed over Server-Sent Events; polling is the fallback when the stream is unavailable.
     useEffect(() => {
-        fetchStats();
-        const interval = setInterval(fetchStats, 10000); // Poll for new scores
-        return () => clearInterval(interval);
+        let interval: number | undefined;
+        const startPolling = () => {
+            if (interval !== undefined) return;
+            fetchStats();
+            interval = window.setInterval(fetchStats, 10000);
+        };
+        if (typeof EventSource === 'undefined') {
+            startPolling();
+            return () => clearInterval(interval);
+        }
+
+        const source = new EventSource(`${API_BASE_URL}/gamification-stats/stream`);
+        source.addEventListener('score', (event) => {
+            setStats(JSON.parse((event as MessageEvent).data) as GamificationStats);
+        });
+        source.onerror = () => {
+            source.close();
+            startPolling();
+        };
+        return () => {
+            source.close();
+            clearInterval(interval);
+        };
     }, [fetchStats]);
 
     useEffect(() => {
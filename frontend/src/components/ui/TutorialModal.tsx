@@ -1,6 +1,6 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { API_BASE_URL } from '../../config';
-import type { GenerationDetails } from '../../types';
+import type { PublicGalleryPage } from '../../types';
 import './TutorialModal.css';
 
 // Fallback images in case the dynamic fetch fails or the gallery is empty
@@ -23,16 +23,16 @@ const TutorialModal: React.FC<TutorialModalProps> = ({ isVisible, onClose }) =>
         if (isVisible) {
             const fetchImagePair = async () => {
                 try {
-                    const response = await fetch(`${API_BASE_URL}/public-gallery`);
+                    const response = await fetch(`${API_BASE_URL}/public-gallery?limit=1`);
                     if (!response.ok) {
                         throw new Error(`Failed to fetch public gallery with status: ${response.status}`);
                     }
-                    const galleryItems: GenerationDetails[] = await response.json();
+                    const { items: galleryItems }: PublicGalleryPage = await response.json();
                     
                     if (galleryItems && galleryItems.length > 0 && galleryItems[0].generated_image_url) {
                         const firstItem = galleryItems[0];
                         setOriginalImageUrl(`${API_BASE_URL}/images/${firstItem.original_image_filename}`);
-                        setGeneratedImageUrl(`${API_BASE_URL}/images/${firstItem.generated_image_url}`);
+                        setGeneratedImageUrl(`${API_BASE_URL}/images/${firstItem.display_url || firstItem.generated_image_url}`);
                     }
                 } catch (error) {
                     console.error("Could not fetch dynamic tutorial image, using fallback.", error);
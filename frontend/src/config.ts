@@ -2,6 +2,17 @@
 export const API_BASE_URL: string = import.meta.env.VITE_API_BASE_URL || '/api';
 export const POLLING_INTERVAL: number = 2000; // ms
 
+// Kiosks are opened once with ?kiosk=<token>; the token is remembered and sent with
+// transformations so the backend gives them priority over public web clients.
+const kioskParam = new URLSearchParams(window.location.search).get('kiosk');
+if (kioskParam) window.localStorage.setItem('kioskToken', kioskParam);
+export const KIOSK_TOKEN: string | null = window.localStorage.getItem('kioskToken');
+
+// A random id for this browser, sent with transformations and gallery requests so the
+// community gallery can show "my visions" without any account.
+if (!window.localStorage.getItem('clientId')) window.localStorage.setItem('clientId', crypto.randomUUID());
+export const CLIENT_ID: string = window.localStorage.getItem('clientId')!;
+
 /**
  * Checks if the current device is likely a mobile device based on screen width.
  * @returns {boolean} True if the screen width is 768px or less.
@@ -1,17 +1,20 @@
 import { useEffect, useCallback, useRef } from 'react';
-import { API_BASE_URL, POLLING_INTERVAL } from '../config';
+import { API_BASE_URL, POLLING_INTERVAL, KIOSK_TOKEN, CLIENT_ID } from '../config';
 import { useStore } from '../store';
-import type { GalleryImage, Tag, GenerationDetails, SourceImage } from '../types';
+import type { GalleryImage, Tag, GenerationDetails, SourceImage, PublicGalleryPage, CommunityGalleryFilter } from '../types';
 import { Texture } from 'three';
+import { galleryThumbnailFile, readServerSentEvents } from '../utils';
 
 // This hook encapsulates the application's side-effects (API calls, timers)
 // and provides a clean API of "handlers" for components to call.
 export const useAppLogic = () => {
     const pollingRef = useRef<number | null>(null);
+    const eventSourceRef = useRef<EventSource | null>(null);
 
     // Get actions from the store once. They are stable and don't cause re-renders.
     const {
         addLogMessage,
+        appendToLastLogMessage,
         setState,
         setGalleryImages,
         setAvailableTags,
@@ -20,6 +23,7 @@ export const useAppLogic = () => {
         openTutorial, // MODIFIED: Renamed from showTutorial
         closeTutorial,
         setCommunityGalleryItems,
+        appendCommunityGalleryItems,
         optimisticallyUpdateVote,
         openModal,
         closeModal,
@@ -52,9 +56,10 @@ export const useAppLogic = () => {
         };
         fetchInitialData();
         
-        // Cleanup polling on unmount
+        // Cleanup polling and job event streams on unmount
         return () => {
             if (pollingRef.current) clearInterval(pollingRef.current);
+            eventSourceRef.current?.close();
         };
     }, [setGalleryImages, setAvailableTags, openTutorial]); // MODIFIED: Updated dependency array
 
@@ -84,6 +89,41 @@ export const useAppLogic = () => {
         }, POLLING_INTERVAL);
     }, [addLogMessage, setState]);
 
+    // Prefers the server-pushed job event stream and falls back to polling if it is unavailable.
+    const watchJobStatus = useCallback((jobId: string) => {
+        eventSourceRef.current?.close();
+        if (typeof EventSource === 'undefined') {
+            pollJobStatus(jobId);
+            return;
+        }
+
+        const source = new EventSource(`${API_BASE_URL}/job-events/${jobId}`);
+        eventSourceRef.current = source;
+
+        source.addEventListener('status', (event) => {
+            const data = JSON.parse((event as MessageEvent).data);
+            if (data.status === 'processing') {
+                addLogMessage('Renderer picked up the job.');
+            } else if (data.status === 'completed') {
+                source.close();
+                addLogMessage('--- Transformation Complete ---', 'success');
+                setState('generationDetails', data.generation_data as GenerationDetails);
+                setState('isProcessing', false);
+                setState('view', 'comparison');
+            } else if (data.status === 'failed') {
+                source.close();
+                addLogMessage(`Job failed: ${data.error || 'Job failed for an unknown reason.'}`, 'error');
+                setState('isProcessing', false);
+            }
+        });
+
+        source.onerror = () => {
+            // The stream dropped before a final status arrived, so fall back to polling.
+            source.close();
+            if (eventSourceRef.current === source && useStore.getState().isProcessing) pollJobStatus(jobId);
+        };
+    }, [addLogMessage, setState, pollJobStatus]);
+
     const handleTransform = useCallback(async () => {
         const { sourceImageForTransform, selectedTags } = useStore.getState();
         if (!sourceImageForTransform) return;
@@ -92,40 +132,79 @@ export const useAppLogic = () => {
         setState('logMessages', [{time: new Date().toLocaleTimeString('en-GB'), text: '--- Initiating Transformation Protocol ---', type: 'system'}]);
         
         try {
+            // Local files are uploaded once as binary; both requests then refer to them by id.
+            let imageReference: { imageBase64?: string; imageId?: string } = { imageBase64: sourceImageForTransform.url };
+            if (sourceImageForTransform.file) {
+                addLogMessage('Uploading image...');
+                const formData = new FormData();
+                formData.append('file', sourceImageForTransform.file);
+                const uploadResponse = await fetch(`${API_BASE_URL}/uploads`, { method: 'POST', body: formData });
+                if (!uploadResponse.ok) throw new Error(`Image upload failed: ${uploadResponse.statusText}`);
+                const { image_id } = await uploadResponse.json();
+                imageReference = { imageId: image_id };
+            }
+
             addLogMessage('Step 1/3: Generating vision prompt...');
-            const promptResponse = await fetch(`${API_BASE_URL}/generate-prompt`, { 
-                method: 'POST', 
-                headers: { 'Content-Type': 'application/json' }, 
-                body: JSON.stringify({ imageBase64: sourceImageForTransform.url, tags: selectedTags }) 
-            });
-            if (!promptResponse.ok) throw new Error(`AI Vision Connection failed: ${promptResponse.statusText}`);
-            const promptData = await promptResponse.json();
-            addLogMessage('Vision prompt generated.');
-            addLogMessage(`Prompt: ${promptData.prompt}`);
+            const promptRequest = {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ...imageReference, tags: selectedTags })
+            };
+            // The prompt is streamed into the log as the model writes it; the plain endpoint is the fallback.
+            let promptData = null as { prompt: string; tags_used: string[] } | null;
+            const streamResponse = await fetch(`${API_BASE_URL}/generate-prompt/stream`, promptRequest);
+            if (streamResponse.ok && streamResponse.body) {
+                addLogMessage('Prompt: ');
+                await readServerSentEvents(streamResponse, (event, data) => {
+                    const payload = JSON.parse(data);
+                    if (event === 'token') appendToLastLogMessage(payload.text);
+                    else if (event === 'prompt') promptData = payload;
+                    else if (event === 'error') throw new Error(payload.detail);
+                });
+                if (!promptData) throw new Error('AI Vision Connection closed before the prompt was complete.');
+                addLogMessage('Vision prompt generated.');
+            } else {
+                const promptResponse = await fetch(`${API_BASE_URL}/generate-prompt`, promptRequest);
+                if (!promptResponse.ok) throw new Error(`AI Vision Connection failed: ${promptResponse.statusText}`);
+                promptData = await promptResponse.json();
+                addLogMessage('Vision prompt generated.');
+                addLogMessage(`Prompt: ${promptData!.prompt}`);
+            }
+            const { prompt, tags_used } = promptData!;
     
             addLogMessage('Step 2/3: Submitting to FLUX renderer...');
             const transformResponse = await fetch(`${API_BASE_URL}/transform-image`, { 
                 method: 'POST', 
-                headers: { 'Content-Type': 'application/json' }, 
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-Client-Id': CLIENT_ID,
+                    ...(KIOSK_TOKEN ? { 'X-Kiosk-Token': KIOSK_TOKEN } : {}),
+                }, 
                 body: JSON.stringify({ 
-                    imageBase64: sourceImageForTransform.url, 
-                    prompt: promptData.prompt,
-                    tags: promptData.tags_used,
+                    ...imageReference,
+                    prompt,
+                    tags: tags_used,
                     original_filename: sourceImageForTransform.name
                 }) 
             });
+            // 429/503 mean the renderers are at capacity; the backend explains how long to wait.
+            if (transformResponse.status === 429 || transformResponse.status === 503) {
+                const { detail } = await transformResponse.json();
+                throw new Error(detail);
+            }
             if (!transformResponse.ok) throw new Error(`FLUX renderer submission failed: ${transformResponse.statusText}`);
-            const { job_id } = await transformResponse.json();
+            const { job_id, estimated_wait_seconds } = await transformResponse.json();
             setState('jobId', job_id);
             addLogMessage(`Job submitted with ID: ${job_id}.`);
+            if (estimated_wait_seconds) addLogMessage(`Estimated time to result: ~${Math.max(Math.round(estimated_wait_seconds / 60), 1)} min.`);
             
             addLogMessage('Step 3/3: Awaiting result...');
-            pollJobStatus(job_id);
+            watchJobStatus(job_id);
         } catch (err) {
             addLogMessage(`PROCESS FAILED: ${(err as Error).message}`, 'error');
             setState('isProcessing', false);
         }
-    }, [pollJobStatus, addLogMessage, setState]);
+    }, [watchJobStatus, addLogMessage, appendToLastLogMessage, setState]);
 
     const handleBackToStart = useCallback(() => {
         resetForNewTransform();
@@ -136,7 +215,7 @@ export const useAppLogic = () => {
         const { galleryImages } = useStore.getState();
         const thumbnailSrc = texture.image.src;
         const thumbnailFilename = thumbnailSrc.split('/').pop();
-        const fullImage = galleryImages.find(img => img.thumbnail === thumbnailFilename);
+        const fullImage = galleryImages.find(img => galleryThumbnailFile(img) === thumbnailFilename);
         if (fullImage) {
             const source: SourceImage = {
                 url: `${API_BASE_URL}/images/${fullImage.filename}`,
@@ -182,17 +261,47 @@ export const useAppLogic = () => {
         }
     }, [handleBackToStart]);
     
+    // The public gallery URL for the current filter, optionally continuing after `cursor`.
+    const publicGalleryUrl = (cursor?: string): string => {
+        const { tag, creator, mine } = useStore.getState().communityGalleryFilter;
+        const params = new URLSearchParams();
+        if (tag) params.set('tag', tag);
+        if (creator) params.set('creator', creator);
+        if (mine) params.set('mine', 'true');
+        if (cursor) params.set('cursor', cursor);
+        const query = params.toString();
+        return `${API_BASE_URL}/public-gallery${query ? `?${query}` : ''}`;
+    };
+
     const fetchCommunityGallery = useCallback(async () => {
         try {
-            const response = await fetch(`${API_BASE_URL}/public-gallery`);
+            const response = await fetch(publicGalleryUrl(), { headers: { 'X-Client-Id': CLIENT_ID } });
             if (!response.ok) throw new Error('Failed to fetch gallery');
-            const data: GenerationDetails[] = await response.json();
-            setCommunityGalleryItems(data);
+            const page: PublicGalleryPage = await response.json();
+            setCommunityGalleryItems(page.items, page.next_cursor);
         } catch (error) {
              console.error("Error fetching community gallery:", error);
         }
     }, [setCommunityGalleryItems]);
 
+    const loadMoreCommunityGallery = useCallback(async () => {
+        const { communityGalleryCursor } = useStore.getState();
+        if (!communityGalleryCursor) return;
+        try {
+            const response = await fetch(publicGalleryUrl(communityGalleryCursor), { headers: { 'X-Client-Id': CLIENT_ID } });
+            if (!response.ok) throw new Error('Failed to fetch gallery page');
+            const page: PublicGalleryPage = await response.json();
+            appendCommunityGalleryItems(page.items, page.next_cursor);
+        } catch (error) {
+             console.error("Error fetching community gallery page:", error);
+        }
+    }, [appendCommunityGalleryItems]);
+
+    const setCommunityGalleryFilter = useCallback((filter: CommunityGalleryFilter) => {
+        setState('communityGalleryFilter', filter);
+        fetchCommunityGallery();
+    }, [setState, fetchCommunityGallery]);
+
     const handleVote = useCallback(async (generationId: string) => {
         optimisticallyUpdateVote(generationId); // Update UI immediately
         try {
@@ -223,6 +332,8 @@ export const useAppLogic = () => {
             handleCloseTutorial: closeTutorial,
             handleShowTutorial: openTutorial, // MODIFIED: Point to the renamed action
             fetchCommunityGallery,
+            loadMoreCommunityGallery,
+            setCommunityGalleryFilter,
             setState,
         }
     };
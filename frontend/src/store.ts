@@ -1,5 +1,5 @@
 import { create } from 'zustand';
-import type { LogMessage, SourceImage, GenerationDetails, GalleryImage, Tag } from './types';
+import type { LogMessage, SourceImage, GenerationDetails, GalleryImage, Tag, CommunityGalleryFilter } from './types';
 
 // Define the shape of the store's state
 export interface StoreState {
@@ -14,6 +14,8 @@ export interface StoreState {
     showTutorial: boolean;
     galleryImages: GalleryImage[];
     communityGalleryItems: GenerationDetails[];
+    communityGalleryCursor: string | null;
+    communityGalleryFilter: CommunityGalleryFilter;
     availableTags: Tag[];
     selectedTags: string[];
     modalItem: GenerationDetails | null;
@@ -23,6 +25,7 @@ export interface StoreState {
 export interface StoreActions {
     setState: <K extends keyof StoreState>(key: K, value: StoreState[K]) => void;
     addLogMessage: (text: string, type?: LogMessage['type']) => void;
+    appendToLastLogMessage: (text: string) => void;
     resetForNewTransform: () => void;
     startTransform: (sourceImage: SourceImage) => void;
     toggleTag: (tagId: string) => void;
@@ -31,7 +34,8 @@ export interface StoreActions {
     openTutorial: () => void; // MODIFIED: Renamed from showTutorial
     closeTutorial: () => void;
     setGalleryImages: (images: GalleryImage[]) => void;
-    setCommunityGalleryItems: (items: GenerationDetails[]) => void;
+    setCommunityGalleryItems: (items: GenerationDetails[], nextCursor: string | null) => void;
+    appendCommunityGalleryItems: (items: GenerationDetails[], nextCursor: string | null) => void;
     setAvailableTags: (tags: Tag[]) => void;
     optimisticallyUpdateVote: (generationId: string) => void;
 }
@@ -56,6 +60,8 @@ export const useStore = create<StoreState & StoreActions>((set, get) => ({
     showTutorial: false,
     galleryImages: [],
     communityGalleryItems: [],
+    communityGalleryCursor: null,
+    communityGalleryFilter: { tag: null, creator: null, mine: false },
     availableTags: [],
     selectedTags: [],
     modalItem: null,
@@ -68,6 +74,12 @@ export const useStore = create<StoreState & StoreActions>((set, get) => ({
         const newLog: LogMessage = { time: formatTime(), text, type };
         set(state => ({ logMessages: [...state.logMessages, newLog] }));
     },
+
+    appendToLastLogMessage: (text) => set(state => {
+        const last = state.logMessages[state.logMessages.length - 1];
+        if (!last) return {};
+        return { logMessages: [...state.logMessages.slice(0, -1), { ...last, text: last.text + text }] };
+    }),
     
     resetForNewTransform: () => set({
         sourceImageForTransform: null,
@@ -102,7 +114,18 @@ export const useStore = create<StoreState & StoreActions>((set, get) => ({
     },
     
     setGalleryImages: (images) => set({ galleryImages: images }),
-    setCommunityGalleryItems: (items) => set({ communityGalleryItems: items.sort((a, b) => b.votes - a.votes) }),
+    setCommunityGalleryItems: (items, nextCursor) => set({
+        communityGalleryItems: items.sort((a, b) => b.votes - a.votes),
+        communityGalleryCursor: nextCursor,
+    }),
+    // Pages arrive already ordered by the server, so later pages are simply appended.
+    appendCommunityGalleryItems: (items, nextCursor) => set(state => {
+        const seen = new Set(state.communityGalleryItems.map(item => item.id));
+        return {
+            communityGalleryItems: [...state.communityGalleryItems, ...items.filter(item => !seen.has(item.id))],
+            communityGalleryCursor: nextCursor,
+        };
+    }),
     setAvailableTags: (tags) => set({ availableTags: tags }),
     
     optimisticallyUpdateVote: (generationId: string) => {
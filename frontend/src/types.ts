@@ -16,6 +16,8 @@ export interface GenerationDetails {
     status: JobStatus;
     original_image_filename: string;
     generated_image_url: string | null;
+    thumbnail_url?: string | null; // WebP card-sized version of the generated image
+    display_url?: string | null; // WebP screen-sized version of the generated image
     prompt_text: string | null;
     tags_used: string[] | null;
     creator_name: string | null;
@@ -24,9 +26,26 @@ export interface GenerationDetails {
     created_at: string; // ISO date string
 }
 
+// Filters of the community gallery; null/false shows everything.
+export interface CommunityGalleryFilter {
+    tag: string | null; // tag id
+    creator: string | null;
+    mine: boolean;
+}
+
+export interface PublicGalleryPage {
+    items: GenerationDetails[];
+    next_cursor: string | null;
+}
+
 export interface GalleryImage {
     filename: string;
     thumbnail: string;
+    // Responsive variants by longest edge, e.g. thumbnails['400'].webp. Empty until rendered.
+    thumbnails?: Record<string, { webp: string; jpeg: string }>;
+    // Displayed size of the source image, once the asset manifest has recorded it.
+    width?: number | null;
+    height?: number | null;
 }
 
 export interface GamificationStats {
@@ -38,6 +57,7 @@ export interface GamificationStats {
 export interface SourceImage {
     url: string;
     name: string;
+    file?: File; // Set for local uploads; sent as multipart before transforming.
 }
 
 export interface LogMessage {
@@ -1,7 +1,36 @@
-export const fileToDataUrl = (file: File): Promise<string> => new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.onload = () => resolve(reader.result as string);
-    reader.onerror = reject;
-    reader.readAsDataURL(file);
-});
+import type { GalleryImage } from './types';
 
+/**
+ * Picks the thumbnail file to load for a gallery image, preferring the WebP variant of the given size.
+ */
+export const galleryThumbnailFile = (image: GalleryImage, size: string = '400'): string =>
+    image.thumbnails?.[size]?.webp ?? image.thumbnail;
+
+/**
+ * Reads a Server-Sent Events response body (e.g. from a POST, which EventSource can't send)
+ * and calls `onEvent` with each event's name and data as they arrive.
+ */
+export const readServerSentEvents = async (
+    response: Response,
+    onEvent: (event: string, data: string) => void,
+): Promise<void> => {
+    const reader = response.body!.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value.replace(/\r\n/g, '\n');
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            const data: string[] = [];
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data.push(line.slice(5).replace(/^ /, ''));
+            }
+            if (data.length) onEvent(event, data.join('\n'));
+        }
+    }
+};
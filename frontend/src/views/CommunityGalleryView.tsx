@@ -1,6 +1,6 @@
 import React, { useEffect, useCallback, useState, useRef } from 'react';
 import ComparisonView from '../components/ui/ComparisonView';
-import type { GenerationDetails } from '../types';
+import type { GenerationDetails, Tag, CommunityGalleryFilter } from '../types';
 import { API_BASE_URL } from '../config';
 import './CommunityGalleryView.css';
 
@@ -13,6 +13,11 @@ import './CommunityGalleryView.css';
  * @property {(item: GenerationDetails) => void} onItemSelect - Callback to select an item for modal view.
  * @property {() => void} onModalClose - Callback to close the modal.
  * @property {() => void} fetchGallery - Callback to fetch/refresh the gallery items.
+ * @property {boolean} hasMore - Whether the server has more gallery pages to load.
+ * @property {() => void} onLoadMore - Callback to append the next page of gallery items.
+ * @property {Tag[]} tags - The tags the gallery can be filtered by.
+ * @property {CommunityGalleryFilter} filter - The active gallery filter.
+ * @property {(filter: CommunityGalleryFilter) => void} onFilterChange - Callback to change the filter and reload.
  */
 interface CommunityGalleryViewProps {
     isVisible: boolean;
@@ -22,6 +27,11 @@ interface CommunityGalleryViewProps {
     onItemSelect: (item: GenerationDetails) => void;
     onModalClose: () => void;
     fetchGallery: () => void;
+    hasMore: boolean;
+    onLoadMore: () => void;
+    tags: Tag[];
+    filter: CommunityGalleryFilter;
+    onFilterChange: (filter: CommunityGalleryFilter) => void;
 }
 
 type ComparisonMode = 'slider' | 'side-by-side';
@@ -34,6 +44,11 @@ const CommunityGalleryView: React.FC<CommunityGalleryViewProps> = ({
     onItemSelect,
     onModalClose,
     fetchGallery,
+    hasMore,
+    onLoadMore,
+    tags,
+    filter,
+    onFilterChange,
 }) => {
     const [modalComparisonMode, setModalComparisonMode] = useState<ComparisonMode>('side-by-side');
     const modalRef = useRef<HTMLDivElement>(null);
@@ -79,6 +94,11 @@ const CommunityGalleryView: React.FC<CommunityGalleryViewProps> = ({
         onVote(itemId);
     };
 
+    const handleCreatorClick = (e: React.MouseEvent<HTMLButtonElement>, creator: string) => {
+        e.stopPropagation();
+        onFilterChange({ ...filter, creator });
+    };
+
     const handleModalVote = useCallback(() => {
         if (!modalItem) return;
         onVote(modalItem.id);
@@ -89,11 +109,23 @@ const CommunityGalleryView: React.FC<CommunityGalleryViewProps> = ({
             <div className="gallery-info-text">
                 <p>Explore visions of Almere 2075 created by others. <b>Give a "👍" to your favorites</b> to help the city reach its happiness goal!</p>
             </div>
+            <div className="gallery-filter-bar">
+                <button className={!filter.tag && !filter.creator && !filter.mine ? 'active' : ''} onClick={() => onFilterChange({ tag: null, creator: null, mine: false })}>All</button>
+                <button className={filter.mine ? 'active' : ''} onClick={() => onFilterChange({ ...filter, mine: !filter.mine })}>My visions</button>
+                {tags.map(tag => (
+                    <button key={tag.id} className={filter.tag === tag.id ? 'active' : ''} onClick={() => onFilterChange({ ...filter, tag: filter.tag === tag.id ? null : tag.id })}>
+                        {tag.name}
+                    </button>
+                ))}
+                {filter.creator && (
+                    <button className="active" onClick={() => onFilterChange({ ...filter, creator: null })}>by {filter.creator} ✕</button>
+                )}
+            </div>
             <div className="gallery-grid-container">
                 {items.map(item => (
                     <div key={item.id} className="gallery-item" onClick={() => onItemSelect(item)}>
                         <div className="gallery-item-images">
-                            {item.generated_image_url && <img src={`${API_BASE_URL}/images/${item.generated_image_url}`} alt="Generated" className="gallery-item-thumb generated"/>}
+                            {item.generated_image_url && <img src={`${API_BASE_URL}/images/${item.thumbnail_url || item.generated_image_url}`} alt="Generated" loading="lazy" className="gallery-item-thumb generated"/>}
                             <img src={`${API_BASE_URL}/images/${item.original_image_filename}`} alt="Original" className="gallery-item-thumb original"/>
                         </div>
                         <div className="gallery-item-info">
@@ -102,7 +134,9 @@ const CommunityGalleryView: React.FC<CommunityGalleryViewProps> = ({
                                     {item.tags_used?.slice(0, 3).join(', ') || 'General Concept'}
                                 </div>
                                 <div className="gallery-item-creator">
-                                   by {item.creator_name || 'Anonymous'}
+                                   by {item.creator_name
+                                       ? <button className="creator-link" onClick={(e) => handleCreatorClick(e, item.creator_name!)}>{item.creator_name}</button>
+                                       : 'Anonymous'}
                                 </div>
                             </div>
                             <button className="like-button" onClick={(e) => handleVoteClick(e, item.id)}>
@@ -111,6 +145,9 @@ const CommunityGalleryView: React.FC<CommunityGalleryViewProps> = ({
                         </div>
                     </div>
                 ))}
+                {hasMore && (
+                    <button className="load-more-button" onClick={onLoadMore}>Show more visions</button>
+                )}
             </div>
 
             {modalItem && (
@@ -1,6 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Canvas } from '@react-three/fiber';
-import { fileToDataUrl } from '../utils';
 import DynamicGallery from '../components/gallery/DynamicGallery';
 import type { GalleryImage, SourceImage } from '../types';
 import type { Texture } from 'three';
@@ -78,15 +77,14 @@ const GalleryView: React.FC<GalleryViewProps> = ({ images, isVisible, isInBackgr
         }
     };
 
-    const handleFileSelect = async (e: React.ChangeEvent<HTMLInputElement>) => {
+    const handleFileSelect = (e: React.ChangeEvent<HTMLInputElement>) => {
         const file = e.target.files?.[0];
         if (file) {
             if (file.size > 15 * 1024 * 1024) {
                 alert("File is too large. Please select an image smaller than 15MB.");
                 return;
             }
-            const url = await fileToDataUrl(file);
-            onNewImage({ url, name: file.name });
+            onNewImage({ url: URL.createObjectURL(file), name: file.name, file });
         }
         e.target.value = '';
     };